@@ -1,8 +1,15 @@
 import os
 import uuid
+import importlib.util
 import shutil
+import zipfile
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass
 from io import BytesIO
+from typing import Optional
 
+import numpy as np
 import pandas as pd
 from openpyxl import load_workbook
 from openpyxl.utils import get_column_letter, coordinate_to_tuple
@@ -13,88 +20,212 @@ OUTPUT_FILENAME = "generated_data.xlsx"
 # اسم فولدر الصور تحت الروت
 IMAGES_FOLDER_NAME = "images"
 
+# xlsxwriter أسرع بكثير من openpyxl في كتابة الملفات الكبيرة؛ نستخدمه إن كان مثبتاً
+OUTPUT_ENGINE = "xlsxwriter" if importlib.util.find_spec("xlsxwriter") else "openpyxl"
+
+# النصوص التي كانت pandas تعتبرها NaN عند قراءة الشيت (na_values الافتراضية في read_excel)؛
+# نسخة ثابتة من pandas._libs.parsers.STR_NA_VALUES حتى لا نعتمد على API داخلي.
+PANDAS_NA_STRINGS = frozenset({
+    "",
+    "#N/A",
+    "#N/A N/A",
+    "#NA",
+    "-1.#IND",
+    "-1.#QNAN",
+    "-NaN",
+    "-nan",
+    "1.#IND",
+    "1.#QNAN",
+    "<NA>",
+    "N/A",
+    "NA",
+    "NULL",
+    "NaN",
+    "None",
+    "n/a",
+    "nan",
+    "null",
+})
+
+# خلايا الخطأ في إكسل (#DIV/0!, #REF!, #VALUE!, ...): pandas كانت ترجع NaN لكل خلية من نوع خطأ،
+# بينما openpyxl (values_only) يرجعها كنص
+EXCEL_ERROR_STRINGS = frozenset({
+    "#DIV/0!",
+    "#GETTING_DATA",
+    "#N/A",
+    "#NAME?",
+    "#NULL!",
+    "#NUM!",
+    "#REF!",
+    "#VALUE!",
+})
+
+# كل النصوص التي تصبح None في collect_sheet_rows
+EMPTY_CELL_STRINGS = PANDAS_NA_STRINGS | EXCEL_ERROR_STRINGS
+
 # ثابت للتحويل من point إلى EMU (وحدة القياس الداخلية في إكسل)
 EMU_PER_POINT = 12700
 
+# أعمدة الخرج التي تبقى فارغة (تُعبّأ يدوياً لاحقاً)
+EXTRA_NULL_COLUMNS = (
+    "delete",
+    "price",
+    "Description",
+    "Old Part No.",
+    "Names and specifications of old parts",
+    "note",
+    "is_red",
+    "is_line",
+    "is_deleted",
+    "is_orange",
+    "internal_notes",
+)
+
+
+@dataclass(slots=True)
+class Section:
+    """باكيج واحدة داخل الشيت (كل الأرقام أسطر 0-based مثل pandas)."""
+    idx: int
+    title_row: int
+    header_row: int
+    data_start: int
+    data_end: int
+    span_start: int
+    span_end: int
+    package_guid: Optional[str] = None
+    image_filename: str = ""
+
+
+def iter_manual_files(root_dir: str):
+    """
+    ابحث (بشكل تكراري وبدون بناء قوائم وسيطة) عن كل ملفات الـ xlsx
+    ما عدا ملف الداتا الناتج داخل الروت.
+    نستعمل os.scandir لأن DirEntry يعرف نوع الملف بدون stat إضافي لكل ملف.
+    """
+    output_lower = OUTPUT_FILENAME.lower()
+    with os.scandir(root_dir) as entries:
+        for entry in entries:
+            if entry.is_dir(follow_symlinks=False):
+                yield from iter_manual_files(entry.path)
+                continue
+            if not entry.is_file():
+                continue
 
-def find_manual_files(root_dir: str):
-    """ابحث عن كل ملفات الـ xlsx (ما عدا ملف الداتا الناتج) داخل الروت."""
-    manual_files = []
-    for dirpath, _, filenames in os.walk(root_dir):
-        for name in filenames:
-            lower = name.lower()
+            lower = entry.name.lower()
             if not lower.endswith(".xlsx"):
                 continue
             if lower.startswith("~$"):
                 # ملفات مؤقتة يفتحها إكسل
                 continue
-            if lower == OUTPUT_FILENAME.lower():
+            if lower == output_lower:
                 # لا نعيد معالجة ملف الداتا الناتج
                 continue
-            manual_files.append(os.path.join(dirpath, name))
-    return manual_files
+            yield entry.path
+
+
+def to_numeric_or_nan(series: pd.Series) -> pd.Series:
+    """تحويل العمود إلى أرقام، وأي قيمة غير رقمية (أو لانهائية) تصبح NaN."""
+    num = pd.to_numeric(series, errors="coerce")
+    return num.where(np.isfinite(num))
+
+
+def strip_text_or_none(series: pd.Series) -> pd.Series:
+    """str(v).strip() لكل قيمة غير فارغة، و None للقيم الفارغة."""
+    text = series.astype("string").str.strip().astype(object)
+    return text.where(series.notna(), None)
+
+
+def has_text(series: pd.Series) -> pd.Series:
+    """
+    True للقيم غير الفارغة: أي قيمة غير NaN، والنصوص يجب ألا تكون فراغات فقط.
+    نستعمل dtype "string" في pandas (يكون pyarrow لو كانت المكتبة متوفرة).
+    """
+    return series.notna() & series.astype("string").str.strip().ne("").fillna(False)
+
+
+def column_or_none(df: pd.DataFrame, col) -> pd.Series:
+    """العمود المطلوب من df، أو عمود من None لو كان رقم العمود خارج الشيت."""
+    if col in df.columns:
+        return df[col]
+    return pd.Series(None, index=df.index, dtype=object)
 
 
-def to_int_or_none(value):
-    """محاولة تحويل القيمة إلى int وإرجاع None لو فشل."""
+def guess_image_ext(data: bytes) -> Optional[str]:
+    """
+    تخمين بسيط لامتداد الصورة من أول بايتات بدون فك الصورة.
+    لو ما عرفنا النوع نرجّع None (والمستدعي يسأل PIL).
+    """
+    if data.startswith(b"\x89PNG\r\n\x1a\n"):
+        return "png"
+    if data.startswith(b"\xff\xd8"):
+        return "jpg"
+    if data.startswith(b"GIF87a") or data.startswith(b"GIF89a"):
+        return "gif"
+    if data.startswith(b"BM"):
+        return "bmp"
+    if data.startswith(b"II*\x00") or data.startswith(b"MM\x00*"):
+        return "tiff"
+    return None
+
+
+def write_image_file(path: str, data: bytes) -> None:
+    """
+    كتابة بايتات الصورة مباشرة عبر os.open / os.write بدون طبقة الـ buffering في بايثون
+    (البايتات جاهزة ومتصلة في الذاكرة أصلاً).
+    """
+    flags = os.O_WRONLY | os.O_CREAT | os.O_TRUNC | getattr(os, "O_BINARY", 0)
+    fd = os.open(path, flags, 0o644)
     try:
-        if pd.isna(value):
-            return None
-        return int(float(value))
-    except (ValueError, TypeError):
-        return None
+        view = memoryview(data)
+        while view:
+            written = os.write(fd, view)
+            view = view[written:]
+    finally:
+        os.close(fd)
 
 
 def build_row_boundaries(ws):
     """
-    نبني حدود تقريبية لكل صف في الشيت:
-    لكل صف نعطي (row_index_0_based, start_y, end_y) بوحدة EMU.
+    نبني حدود تقريبية لكل صف في الشيت بوحدة EMU:
+    starts[i] و ends[i] هما بداية ونهاية الصف i (0-based مثل pandas).
     هذا مفيد عندما تكون الصورة من نوع AbsoluteAnchor فيها pos.y بدون row.
     """
-    boundaries = []
-    y = 0
-
     default_height_pts = getattr(ws.sheet_format, "defaultRowHeight", None)
     if default_height_pts is None:
         default_height_pts = 15  # ارتفاع افتراضي معقول
 
-    for r in range(1, ws.max_row + 1):
-        dim = ws.row_dimensions.get(r)
-        if dim is not None and dim.height is not None:
-            h_pts = dim.height
-        else:
-            h_pts = default_height_pts
-
-        h_emu = h_pts * EMU_PER_POINT
-        start_y = y
-        end_y = y + h_emu
+    n = ws.max_row
+    heights = np.full(n, default_height_pts, dtype=np.float64)
 
-        # r-1 لأننا نستخدم 0-based مثل pandas
-        boundaries.append((r - 1, start_y, end_y))
-        y = end_y
+    # نعدّل فقط الصفوف التي لها ارتفاع مخصص
+    for r, dim in ws.row_dimensions.items():
+        if dim.height is not None and 1 <= r <= n:
+            heights[r - 1] = dim.height
 
-    return boundaries
+    ends = np.cumsum(heights) * EMU_PER_POINT
+    starts = np.concatenate(([0.0], ends[:-1]))
+    return starts, ends
 
 
-def approx_row_from_y(boundaries, y_pos):
+def approx_row_from_y(centers, y_pos):
     """
     لو عندنا y_pos (بوحدة EMU) بدون row،
-    نحاول إيجاد أقرب صف له اعتماداً على centers للـ boundaries.
+    نحاول إيجاد أقرب صف له اعتماداً على centers للصفوف.
+    centers مرتبة تصاعدياً، لذلك نستعمل بحث ثنائي ونقارن فقط الجارين حول y_pos.
+    عند التساوي نختار الصف الأعلى.
     """
-    if y_pos is None or not boundaries:
+    if y_pos is None or len(centers) == 0:
         return None
 
-    closest_row = boundaries[-1][0]
-    min_dist = float("inf")
+    i = int(np.searchsorted(centers, y_pos))
+    if i == 0:
+        return 0
+    if i == len(centers):
+        return len(centers) - 1
 
-    for row_idx, start_y, end_y in boundaries:
-        center = (start_y + end_y) / 2
-        dist = abs(center - y_pos)
-        if dist < min_dist:
-            min_dist = dist
-            closest_row = row_idx
-
-    return closest_row
+    if abs(centers[i - 1] - y_pos) <= abs(centers[i] - y_pos):
+        return i - 1
+    return i
 
 
 def extract_images(ws, images_dir: str):
@@ -106,35 +237,37 @@ def extract_images(ws, images_dir: str):
         "filename": str,
         "row_idx": int (0-based) أو None لو فشل تحديد الصف
     }
+    ملاحظة: فولدر images_dir يجب أن يكون موجوداً مسبقاً (يُنشأ في main).
     """
-    os.makedirs(images_dir, exist_ok=True)
-
-    boundaries = build_row_boundaries(ws)
+    starts, ends = build_row_boundaries(ws)
+    centers = (starts + ends) / 2
     images = []
 
     for img in ws._images:
         # ---------------- حفظ الصورة على الديسك ----------------
+        # نكتب البايتات الأصلية كما هي (بدون فك ضغط وإعادة ضغط عبر PIL)
+        # ولو ما عرفنا التوقيع (WEBP، ICO ...) نسأل PIL عن الفورمات فقط
         try:
             raw = img._data()
-            pil_img = PILImage.open(BytesIO(raw))
-
-            fmt = (pil_img.format or "JPEG").lower()
-            ext = "jpg" if fmt in ("jpeg", "jpg") else fmt
+            ext = guess_image_ext(raw)
+            if ext is None:
+                fmt = PILImage.open(BytesIO(raw)).format.lower()
+                ext = "jpg" if fmt in ("jpeg", "jpg") else fmt
         except Exception:
-            # لو صار أي خطأ في قراءة الفورمات نستعمل jpg افتراضياً
-            pil_img = None
+            # لو صار أي خطأ في قراءة الصورة نستعمل jpg افتراضياً ولا نكتب ملف
+            raw = None
             ext = "jpg"
 
         guid = str(uuid.uuid4())
         filename = f"{guid}.{ext}"
         full_path = os.path.join(images_dir, filename)
 
-        try:
-            if pil_img is not None:
-                pil_img.save(full_path)
-        except Exception:
-            # لو فشل الحفظ لأي سبب نتجاهل الصورة ولا نكسر السكريبت
-            pass
+        if raw:
+            try:
+                write_image_file(full_path, raw)
+            except OSError as e:
+                # لو فشل الحفظ لأي سبب نتجاهل الصورة ولا نكسر السكريبت
+                print(f"  ⚠ Could not save image {filename}: {e}")
 
         # ---------------- تحديد صف الصورة ----------------
         anchor = img.anchor
@@ -161,14 +294,13 @@ def extract_images(ws, images_dir: str):
             pass
 
         if row_idx is None and y_pos is not None:
-            row_idx = approx_row_from_y(boundaries, y_pos)
+            row_idx = approx_row_from_y(centers, y_pos)
 
         images.append(
             {
                 "guid": guid,
                 "filename": filename,
                 "row_idx": row_idx,
-                "used": False,  # فلاج لكي لا تستعمل الصورة لأكثر من باكيج
             }
         )
 
@@ -194,29 +326,38 @@ def detect_columns_and_headers(df: pd.DataFrame):
     qty_col = None
     header_rows = []
 
-    for r in df.index:
-        for c in df.columns:
-            v = df.iloc[r, c]
-            if not isinstance(v, str):
-                continue
-            txt = v.strip().lower()
-            if txt == "part number":
-                header_rows.append(r)
-                if pn_col is None:
-                    pn_col = c
-                    # نكتشف الأعمدة الأخرى من نفس سطر الهيدر
-                    for cc in df.columns:
-                        vv = df.iloc[r, cc]
-                        if not isinstance(vv, str):
-                            continue
-                        t2 = vv.strip().lower()
-                        if t2.startswith("no"):
-                            no_col = cc
-                        elif "description" in t2:
-                            desc_col = cc
-                        elif t2.startswith("qty"):
-                            qty_col = cc
-                break
+    if df.empty:
+        return pn_col, no_col, desc_col, qty_col, header_rows
+
+    # نحوّل الشيت كله مرة واحدة إلى نصوص (strip + lower) بعمليات pandas بدل لفّة على كل خلية.
+    # الأعمدة الرقمية لا يمكن أن تحتوي كلمات الهيدر، فنعتبرها فارغة.
+    S = df.apply(
+        lambda col: pd.Series(pd.NA, index=col.index, dtype="string")
+        if pd.api.types.is_numeric_dtype(col.dtype)
+        else col.astype("string").str.strip().str.lower()
+    )
+
+    pn_mask = (S == "part number").fillna(False).to_numpy(dtype=bool)
+    # كل أسطر الهيدر دفعة واحدة؛ اكتشاف الأعمدة يتم من السطر الأول فقط
+    header_rows = np.flatnonzero(pn_mask.any(axis=1)).tolist()
+
+    if header_rows:
+        first = header_rows[0]
+        # argmax يعطي أول عمود فيه "Part Number" في سطر الهيدر الأول
+        pn_col = int(df.columns[pn_mask[first].argmax()])
+
+        # نكتشف الأعمدة الأخرى من نفس سطر الهيدر (آخر تطابق يفوز كما في النسخة السابقة)
+        row = S.iloc[first]
+        no_mask = row.str.startswith("no").fillna(False).to_numpy(dtype=bool)
+        desc_mask = row.str.contains("description", regex=False).fillna(False).to_numpy(dtype=bool) & ~no_mask
+        qty_mask = row.str.startswith("qty").fillna(False).to_numpy(dtype=bool) & ~no_mask & ~desc_mask
+
+        if no_mask.any():
+            no_col = int(df.columns[no_mask][-1])
+        if desc_mask.any():
+            desc_col = int(df.columns[desc_mask][-1])
+        if qty_mask.any():
+            qty_col = int(df.columns[qty_mask][-1])
 
     # لو وجدنا عمود Part Number ولم نجد الأعمدة الأخرى، نستخدم مواقع افتراضية نسبية
     if pn_col is not None:
@@ -230,22 +371,77 @@ def detect_columns_and_headers(df: pd.DataFrame):
     return pn_col, no_col, desc_col, qty_col, header_rows
 
 
-def extract_manual_to_flat(manual_path: str, root_dir: str) -> pd.DataFrame:
-    print(f"\nProcessing file: {manual_path}")
+def collect_sheet_rows(ws):
+    """
+    نحوّل قيم الشيت إلى list of lists بعرض موحّد،
+    بحيث rows[r][c] (0-based) يقابل df.iloc[r, c].
+    """
+    rows = [list(r) for r in ws.iter_rows(values_only=True)]
+
+    # نحذف الأسطر الفارغة في آخر الشيت (مثل ما كانت تفعل pandas: الخلية "" تُعد فارغة)
+    while rows and all(v is None or v == "" for v in rows[-1]):
+        rows.pop()
+
+    # pandas كانت تحوّل نصوص NA الافتراضية (N/A, null, ...) وخلايا الخطأ (#N/A, #REF!, ...) إلى NaN؛
+    # نحوّلها إلى None حتى ترى has_text و strip_text_or_none واسم الباكج نفس القيم
+    for r in rows:
+        for c, v in enumerate(r):
+            if type(v) is str and v in EMPTY_CELL_STRINGS:
+                r[c] = None
+
+    # نوحّد طول الأسطر لأن read_only يرجع أسطر بأطوال مختلفة
+    width = max((len(r) for r in rows), default=0)
+    for r in rows:
+        if len(r) < width:
+            r.extend([None] * (width - len(r)))
+
+    return rows
+
+
+def workbook_has_drawings(manual_path: str) -> bool:
+    """نفحص محتويات ملف الـ xlsx (zip) لنعرف هل فيه صور/رسومات بدون فتحه بـ openpyxl."""
+    try:
+        with zipfile.ZipFile(manual_path) as zf:
+            return any(name.startswith("xl/drawings/") for name in zf.namelist())
+    except zipfile.BadZipFile:
+        # نترك openpyxl يعطي رسالة الخطأ المناسبة
+        return True
 
-    title = os.path.splitext(os.path.basename(manual_path))[0].strip()
 
-    # نقرأ الشيت الأولى كـ DataFrame
-    xls = pd.ExcelFile(manual_path)
-    sheet_name = xls.sheet_names[0]
-    df = xls.parse(sheet_name, header=None)
+def read_sheet_rows_and_images(manual_path: str, images_dir: str):
+    """
+    نقرأ الشيت الأولى مرة واحدة فقط:
+    - لو الملف بدون صور: قراءة متدفقة بوضع read_only.
+    - لو فيه صور: الصور غير متاحة في read_only، فنفتح بالوضع العادي
+      ونأخذ القيم من نفس الفتحة بدل قراءة الملف مرتين.
+    """
+    if not workbook_has_drawings(manual_path):
+        wb = load_workbook(manual_path, data_only=True, read_only=True)
+        try:
+            ws = wb[wb.sheetnames[0]]
+            # في وضع read_only أبعاد الشيت المخزنة قد تكون ناقصة، فنحسبها أثناء القراءة
+            ws.reset_dimensions()
+            rows = collect_sheet_rows(ws)
+        finally:
+            wb.close()
+        return rows, []
 
-    # نفتح نفس الشيت كـ openpyxl للحصول على الصور
     wb = load_workbook(manual_path, data_only=True)
     ws = wb[wb.sheetnames[0]]
+    rows = collect_sheet_rows(ws)
+    images_info = extract_images(ws, images_dir)
+    return rows, images_info
+
+
+def extract_manual_to_flat(manual_path: str, root_dir: str) -> pd.DataFrame:
+    print(f"\nProcessing file: {manual_path}")
 
+    title = os.path.splitext(os.path.basename(manual_path))[0].strip()
+
+    # قراءة واحدة للملف: القيم (لبناء DataFrame) + الصور
     images_dir = os.path.join(root_dir, IMAGES_FOLDER_NAME)
-    images_info = extract_images(ws, images_dir)
+    rows, images_info = read_sheet_rows_and_images(manual_path, images_dir)
+    df = pd.DataFrame.from_records(rows)
 
     # نكتشف الأعمدة والهيدر
     pn_col, no_col, desc_col, qty_col, header_rows = detect_columns_and_headers(df)
@@ -256,31 +452,19 @@ def extract_manual_to_flat(manual_path: str, root_dir: str) -> pd.DataFrame:
     # ---------------- تعريف الباكيجات (sections) ----------------
     sections = []
 
+    # أي سطر فيه Part Number أو Description (غير فارغ) نعتبره سطر داتا.
+    # نحسب هذا القناع مرة واحدة لكل الشيت بعمليات النصوص في pandas بدل فحص كل خلية.
+    is_data_row = (
+        has_text(column_or_none(df, pn_col)) | has_text(column_or_none(df, desc_col))
+    ).to_numpy(dtype=bool)
+
     for i, header_row in enumerate(header_rows):
         title_row = header_row - 1  # السطر الذي يحتوي اسم الباكج مثل REAR WHEELS
 
         # نهاية نطاق البحث عن بيانات هذه الباكج: قبل هيدر الباكج التالية
         next_header = header_rows[i + 1] if i + 1 < len(header_rows) else len(df)
 
-        data_rows = []
-        for r in range(header_row + 1, next_header):
-            if r not in df.index:
-                continue
-            partno = df.iloc[r, pn_col] if pn_col in df.columns else None
-            desc = df.iloc[r, desc_col] if desc_col in df.columns else None
-
-            has_part = (
-                (isinstance(partno, str) and partno.strip() != "")
-                or (not isinstance(partno, str) and not pd.isna(partno))
-            )
-            has_desc = (
-                (isinstance(desc, str) and desc.strip() != "")
-                or (not isinstance(desc, str) and not pd.isna(desc))
-            )
-
-            # أي سطر فيه Part Number أو Description نعتبره سطر داتا
-            if has_part or has_desc:
-                data_rows.append(r)
+        data_rows = (np.flatnonzero(is_data_row[header_row + 1:next_header]) + header_row + 1).tolist()
 
         if not data_rows:
             # باكيج بدون عناصر حقيقية، نتجاهلها
@@ -294,54 +478,49 @@ def extract_manual_to_flat(manual_path: str, root_dir: str) -> pd.DataFrame:
         span_end = data_end
 
         sections.append(
-            {
-                "idx": i,
-                "title_row": title_row,
-                "header_row": header_row,
-                "data_start": data_start,
-                "data_end": data_end,
-                "span_start": span_start,
-                "span_end": span_end,
-                "package_guid": None,
-                "image_filename": "",
-            }
+            Section(
+                idx=i,
+                title_row=title_row,
+                header_row=header_row,
+                data_start=data_start,
+                data_end=data_end,
+                span_start=span_start,
+                span_end=span_end,
+            )
         )
 
     # ---------------- ربط الصور بالباكيجات ----------------
+    # الصور مرتبة حسب الصف والباكيجات مرتبة حسب span_start،
+    # فنأخذ الصور من أول الطابور: كل صورة تُستعمل مرة واحدة أو تُرمى (O(I + S)).
+    unused_images = deque(img for img in images_info if img["row_idx"] is not None)
+
     for sec in sections:
-        span_start = sec["span_start"]
-        span_end = sec["span_end"]
+        # الصور قبل بداية هذه الباكيج لن تقع في أي باكيج لاحقة
+        while unused_images and unused_images[0]["row_idx"] < sec.span_start:
+            unused_images.popleft()
 
         chosen_image = None
-        for img in images_info:
-            if img["used"]:
-                continue
-            row_idx = img["row_idx"]
-            if row_idx is None:
-                continue
-            if span_start <= row_idx <= span_end:
-                chosen_image = img
-                img["used"] = True
-                break
+        if unused_images and unused_images[0]["row_idx"] <= sec.span_end:
+            chosen_image = unused_images.popleft()
 
         if chosen_image is not None:
-            sec["package_guid"] = chosen_image["guid"]
-            sec["image_filename"] = chosen_image["filename"]
+            sec.package_guid = chosen_image["guid"]
+            sec.image_filename = chosen_image["filename"]
         else:
             # باكيج بدون صورة، نعطيها GUID جديد لكن بدون ملف صورة
-            sec["package_guid"] = str(uuid.uuid4())
-            sec["image_filename"] = ""
+            sec.package_guid = str(uuid.uuid4())
+            sec.image_filename = ""
 
     # ---------------- تحويل الباكيجات إلى داتا فلات ----------------
-    all_rows = []
+    package_frames = []
 
     for sec in sections:
-        title_row = sec["title_row"]
-        data_start = sec["data_start"]
-        data_end = sec["data_end"]
+        title_row = sec.title_row
+        data_start = sec.data_start
+        data_end = sec.data_end
 
-        package_guid = sec["package_guid"]
-        image_filename = sec["image_filename"]
+        package_guid = sec.package_guid
+        image_filename = sec.image_filename
 
         # اسم الباكج من العمود A في سطر العنوان
         package_name = ""
@@ -357,68 +536,59 @@ def extract_manual_to_flat(manual_path: str, root_dir: str) -> pd.DataFrame:
             if qty_col in df.columns:
                 df.loc[data_start:data_end, qty_col] = df.loc[data_start:data_end, qty_col].ffill()
 
-        row_idx = data_start
-        while row_idx <= data_end:
-            part_no = df.iloc[row_idx, pn_col] if pn_col in df.columns else None
-            part_name = df.iloc[row_idx, desc_col] if desc_col in df.columns else None
-
-            if pd.isna(part_no) and pd.isna(part_name):
-                row_idx += 1
-                continue
+        # بدون عمود No لا يوجد أي سطر صالح في هذه الباكيج
+        if data_start > data_end or no_col not in df.columns:
+            continue
 
-            no_val = df.iloc[row_idx, no_col] if no_col in df.columns else None
-            qty = df.iloc[row_idx, qty_col] if qty_col in df.columns else None
+        # نأخذ شريحة الباكيج مرة واحدة ونحسب كل شيء عليها بعمليات pandas
+        sub = df.loc[data_start:data_end]
+        part_no = column_or_none(sub, pn_col)
+        part_name = column_or_none(sub, desc_col)
+        no_num = to_numeric_or_nan(sub[no_col])
+
+        # السطر يجب أن يحتوي Part Number أو Description، ورقم No صحيح.
+        # الأقنعة كمصفوفات NumPy (بدون محاذاة index في pandas عند الدمج والفلترة)
+        notnull_no = no_num.notna().to_numpy()
+        notnull_pn = part_no.notna().to_numpy()
+        notnull_desc = part_name.notna().to_numpy()
+        mask = notnull_no & (notnull_pn | notnull_desc)
+        if not mask.any():
+            continue
 
-            no_int = to_int_or_none(no_val)
-            if no_int is None:
-                row_idx += 1
-                continue
+        # QTY نحوّله فقط للأسطر المقبولة
+        qty_num = to_numeric_or_nan(column_or_none(sub, qty_col)[mask])
 
-            row_dict = {
+        out = pd.DataFrame(
+            {
                 "PackageId": package_guid,
                 "ImagePath": image_filename,
                 "Title - TRIM": title,
                 "PackageName": package_name,
-                "No": no_int,
-                "PartNo": str(part_no).strip() if pd.notna(part_no) else None,
-                "Part Name And Standard": str(part_name).strip() if pd.notna(part_name) else None,
-                "QTY": to_int_or_none(qty),
+                "No": np.trunc(no_num[mask]).astype(int),
+                "PartNo": strip_text_or_none(part_no[mask]),
+                "Part Name And Standard": strip_text_or_none(part_name[mask]),
+                "QTY": np.trunc(qty_num).astype("Int64"),
                 # الحقول الأخرى كما اتفقنا سابقاً
-                "delete": None,
-                "price": None,
-                "Description": None,
-                "Old Part No.": None,
-                "Names and specifications of old parts": None,
-                "note": None,
-                "is_red": None,
-                "is_line": None,
-                "is_deleted": None,
-                "is_orange": None,
-                "internal_notes": None,
+                **{name: None for name in EXTRA_NULL_COLUMNS},
             }
-            all_rows.append(row_dict)
-            row_idx += 1
-
-    return pd.DataFrame(all_rows)
+        )
+        package_frames.append(out)
 
+    if not package_frames:
+        return pd.DataFrame([])
 
-def autosize_columns(path: str):
-    """توسيع الأعمدة لكي تظهر القيم كاملة قدر الإمكان."""
-    wb = load_workbook(path)
-    ws = wb.active
+    return pd.concat(package_frames, ignore_index=True)
 
-    for col_cells in ws.columns:
-        max_len = 0
-        col_letter = get_column_letter(col_cells[0].column)
-        for cell in col_cells:
-            if cell.value is None:
-                continue
-            length = len(str(cell.value))
-            if length > max_len:
-                max_len = length
-        ws.column_dimensions[col_letter].width = min(max_len + 2, 80)
 
-    wb.save(path)
+def compute_column_widths(df: pd.DataFrame):
+    """
+    عرض كل عمود حتى تظهر القيم كاملة قدر الإمكان (أطول قيمة أو اسم العمود + 2، بحد أقصى 80).
+    نحسبه من الـ DataFrame مباشرة بدل إعادة فتح ملف الإكسل بعد كتابته.
+    """
+    lengths = df.apply(lambda col: col.astype("string").str.len().max())
+    lengths = lengths.fillna(0).to_numpy(dtype=np.int64)
+    header_lengths = np.array([len(str(c)) for c in df.columns], dtype=np.int64)
+    return np.minimum(np.maximum(lengths, header_lengths) + 2, 80)
 
 
 def main():
@@ -428,8 +598,10 @@ def main():
     img_root = os.path.join(root_dir, IMAGES_FOLDER_NAME)
     if os.path.isdir(img_root):
         shutil.rmtree(img_root)
+    # ننشئ فولدر الصور مرة واحدة هنا بدل إنشائه لكل شيت
+    os.makedirs(img_root, exist_ok=True)
 
-    manual_files = find_manual_files(root_dir)
+    manual_files = list(iter_manual_files(root_dir))
 
     if not manual_files:
         print("No manual (.xlsx) files found.")
@@ -441,15 +613,25 @@ def main():
 
     all_dfs = []
 
-    for file in manual_files:
-        try:
-            df = extract_manual_to_flat(file, root_dir)
-            if not df.empty:
-                all_dfs.append(df)
-        except Exception as e:
-            print("\n⚠ Error processing file:", file)
-            print("   Type:", type(e).__name__)
-            print("   Message:", e)
+    # كل ملف مستقل عن الآخر، فنعالج الملفات بالتوازي على عدة processes.
+    # أسماء الصور GUID لذلك لا يوجد تعارض عند الكتابة في نفس فولدر الصور.
+    max_workers = min(len(manual_files), os.cpu_count() or 1)
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+        futures = [
+            executor.submit(extract_manual_to_flat, file, root_dir)
+            for file in manual_files
+        ]
+
+        # نجمع النتائج بنفس ترتيب الملفات
+        for file, future in zip(manual_files, futures):
+            try:
+                df = future.result()
+                if not df.empty:
+                    all_dfs.append(df)
+            except Exception as e:
+                print("\n⚠ Error processing file:", file)
+                print("   Type:", type(e).__name__)
+                print("   Message:", e)
 
     if not all_dfs:
         print("No data generated.")
@@ -458,15 +640,25 @@ def main():
     final = pd.concat(all_dfs, ignore_index=True)
     output_path = os.path.join(root_dir, OUTPUT_FILENAME)
 
+    widths = compute_column_widths(final)
+
     try:
-        final.to_excel(output_path, index=False, engine="openpyxl")
+        # ملاحظة: لا نستخدم constant_memory مع xlsxwriter لأن pandas يكتب الخلايا
+        # عموداً عموداً، وهذا الوضع يتجاهل أي كتابة على صف سابق فتضيع البيانات.
+        with pd.ExcelWriter(output_path, engine=OUTPUT_ENGINE) as writer:
+            final.to_excel(writer, index=False)
+            # نضبط عرض الأعمدة على نفس الـ workbook قبل الحفظ (بدون load/save إضافي)
+            ws = writer.sheets["Sheet1"]
+            for i, width in enumerate(widths):
+                if OUTPUT_ENGINE == "xlsxwriter":
+                    ws.set_column(i, i, int(width))
+                else:
+                    ws.column_dimensions[get_column_letter(i + 1)].width = int(width)
     except PermissionError:
         print("\n⚠ Cannot write output file. Please close it if open in Excel:")
         print("  ", output_path)
         return
 
-    autosize_columns(output_path)
-
     print("\nData file generated successfully:")
     print(" ", output_path)
     print("Total rows:", len(final))
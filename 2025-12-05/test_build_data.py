@@ -0,0 +1,171 @@
+import os
+import sys
+import tempfile
+import unittest
+from io import BytesIO
+
+from openpyxl import Workbook
+from PIL import Image as PILImage
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import build_data  # noqa: E402
+
+
+def save_manual(path: str) -> None:
+    """باكيج عنوانها #N/A فيها سطر كله N/A وسطر PartNo فيه #N/A، ثم باكيج عادية."""
+    wb = Workbook()
+    ws = wb.active
+    ws.append(["#N/A"])
+    ws.append([None, "No", "Part Number", "Description", "QTY"])
+    ws.append([None, 1, "PN-1", "Bolt", 2])
+    ws.append([None, 2, "N/A", "N/A", 1])
+    ws.append([None, 3, "#N/A", "Nut", 1])
+    ws.append(["Second"])
+    ws.append([None, "No", "Part Number", "Description", "QTY"])
+    ws.append([None, 1, "PN-9", "Washer", 4])
+    wb.save(path)
+
+
+class PandasNaStringsTest(unittest.TestCase):
+    """القيم التي كانت pandas تقرؤها NaN (N/A و #N/A ...) يجب أن تبقى فارغة."""
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.manual = os.path.join(self.tmp.name, "manual.xlsx")
+        save_manual(self.manual)
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_na_cells_read_as_none(self):
+        rows, images = build_data.read_sheet_rows_and_images(
+            self.manual, os.path.join(self.tmp.name, "images")
+        )
+        self.assertEqual(images, [])
+        self.assertIsNone(rows[0][0])
+        self.assertEqual(rows[3][1:5], [2, None, None, 1])
+        self.assertEqual(rows[4][1:5], [3, None, "Nut", 1])
+
+    def test_flat_rows_match_pandas_na_handling(self):
+        df = build_data.extract_manual_to_flat(self.manual, self.tmp.name)
+        got = [
+            (r["PackageName"], r["No"], r["PartNo"], r["Part Name And Standard"])
+            for _, r in df.iterrows()
+        ]
+        self.assertEqual(
+            got,
+            [
+                ("", 1, "PN-1", "Bolt"),
+                ("", 3, None, "Nut"),
+                ("Second", 1, "PN-9", "Washer"),
+            ],
+        )
+
+
+def save_manual_with_errors(path: str) -> None:
+    """نفس الشكل لكن بخلايا خطأ إكسل حقيقية (#VALUE!, #DIV/0!, #REF! ...) بدل نصوص NA."""
+    wb = Workbook()
+    ws = wb.active
+    ws.append(["#VALUE!"])
+    ws.append([None, "No", "Part Number", "Description", "QTY"])
+    ws.append([None, 1, "PN-1", "Bolt", 2])
+    ws.append([None, 2, "#DIV/0!", "#REF!", 1])
+    ws.append([None, 3, "#NAME?", "Nut", "#NUM!"])
+    ws.append(["Second"])
+    ws.append([None, "No", "Part Number", "Description", "QTY"])
+    ws.append([None, 1, "PN-9", "#NULL!", 4])
+    wb.save(path)
+
+
+class ExcelErrorCellsTest(unittest.TestCase):
+    """pandas كانت ترجع NaN لكل خلية خطأ في إكسل، وليس فقط #N/A."""
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.manual = os.path.join(self.tmp.name, "manual.xlsx")
+        save_manual_with_errors(self.manual)
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_error_cells_read_as_none(self):
+        rows, _ = build_data.read_sheet_rows_and_images(
+            self.manual, os.path.join(self.tmp.name, "images")
+        )
+        self.assertIsNone(rows[0][0])
+        self.assertEqual(rows[3][1:5], [2, None, None, 1])
+        self.assertEqual(rows[4][1:5], [3, None, "Nut", None])
+        self.assertEqual(rows[7][1:5], [1, "PN-9", None, 4])
+
+    def test_flat_rows_match_pandas_error_handling(self):
+        df = build_data.extract_manual_to_flat(self.manual, self.tmp.name)
+        got = [
+            (r["PackageName"], r["No"], r["PartNo"], r["Part Name And Standard"])
+            for _, r in df.iterrows()
+        ]
+        self.assertEqual(
+            got,
+            [
+                ("", 1, "PN-1", "Bolt"),
+                ("", 3, None, "Nut"),
+                ("Second", 1, "PN-9", None),
+            ],
+        )
+
+
+class FakeImage:
+    """بديل بسيط لصورة openpyxl: البايتات الخام والـ anchor فقط."""
+
+    def __init__(self, raw: bytes, anchor: str):
+        self.raw = raw
+        self.anchor = anchor
+
+    def _data(self) -> bytes:
+        return self.raw
+
+
+def encode_image(fmt: str) -> bytes:
+    buf = BytesIO()
+    PILImage.new("RGB", (16, 16), "red").save(buf, format=fmt)
+    return buf.getvalue()
+
+
+class ExtractImagesTest(unittest.TestCase):
+    """الفورمات التي ليس لها توقيع في guess_image_ext تأخذ امتدادها من PIL."""
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.images_dir = self.tmp.name
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_unknown_signatures(self):
+        webp = encode_image("WEBP")
+        ico = encode_image("ICO")
+        self.assertIsNone(build_data.guess_image_ext(webp))
+        self.assertIsNone(build_data.guess_image_ext(ico))
+
+        ws = Workbook().active
+        ws._images = [
+            FakeImage(webp, "A1"),
+            FakeImage(ico, "A2"),
+            FakeImage(b"not an image", "A3"),
+        ]
+        images = build_data.extract_images(ws, self.images_dir)
+
+        self.assertEqual([im["row_idx"] for im in images], [0, 1, 2])
+        exts = [im["filename"].rsplit(".", 1)[1] for im in images]
+        self.assertEqual(exts, ["webp", "ico", "jpg"])
+
+        for im, raw in zip(images[:2], (webp, ico)):
+            with open(os.path.join(self.images_dir, im["filename"]), "rb") as fh:
+                self.assertEqual(fh.read(), raw)
+        self.assertFalse(
+            os.path.exists(os.path.join(self.images_dir, images[2]["filename"]))
+        )
+
+
+if __name__ == "__main__":
+    unittest.main()
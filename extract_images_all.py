@@ -1,10 +1,24 @@
+import copy
+import csv
+import importlib.util
+import io
 import os
-from uuid import uuid4
-from collections import Counter
-from typing import List, Dict, Any, Tuple, Optional
-
-from openpyxl import load_workbook, Workbook
+import posixpath
+import re
+import zipfile
+import xml.etree.ElementTree as ET
+from bisect import bisect_right
+from uuid import UUID
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from itertools import accumulate, chain
+from typing import List, Dict, Any, Iterable, Tuple, Optional
+
+from openpyxl import Workbook
 from openpyxl.drawing.image import Image as XLImage
+from PIL import Image as PILImage
+
+# قراءة الشيت (مشتركة مع packages.py)
+from sheet_reader import read_sheet_data
 
 # ==========================
 # إعدادات عامة
@@ -20,11 +34,22 @@ IMAGES_DIR = os.path.join(SCRIPT_DIR, "images")
 # اسم ملف الداتا الناتج (بجانب السكربت أيضاً)
 OUTPUT_EXCEL = os.path.join(SCRIPT_DIR, "packages_data.xlsx")
 
+# صيغة ملف الإخراج: "xlsx" (مع معاينة الصور في العمود B) أو "csv"
+# (أسرع بكثير للكميات الكبيرة: بدون XML ولا zip، لكن بدون صور مدمجة؛ عمود ImagePath يبقى)
+OUTPUT_FORMAT = "xlsx"
+OUTPUT_CSV = os.path.join(SCRIPT_DIR, "packages_data.csv")
+
+# xlsxwriter أسرع من openpyxl في كتابة الملف الناتج، ويكتب كل صورة مكررة مرة واحدة فقط
+# داخل الملف (openpyxl يكتب نسخة لكل سطر)؛ نستخدمه إن كان مثبتاً
+OUTPUT_ENGINE = "xlsxwriter" if importlib.util.find_spec("xlsxwriter") else "openpyxl"
+
 # كلمات الهيدر التي نبحث عنها (تُقارن بحروف صغيرة)
 HEADER_KEYWORDS = ("part number", "description", "qty")
+# نفس الكلمات كـ regex واحد مُجمّع مسبقاً (بحث واحد بدل any(...) على كل كلمة)
+HEADER_RE = re.compile("|".join(re.escape(keyword) for keyword in HEADER_KEYWORDS))
 
 # قيم إكسل الخطأ التي لا يجب اعتبارها أسماء باكجات
-EXCLUDED_PACKAGE_TOKENS = {
+EXCLUDED_PACKAGE_TOKENS = frozenset({
     "#unknown!",
     "#value!",
     "#div/0!",
@@ -33,8 +58,43 @@ EXCLUDED_PACKAGE_TOKENS = {
     "#null!",
     "#num!",
     "#n/a",
+})
+
+# توقيعات (magic bytes) أنواع الصور → الامتداد
+IMAGE_MAGIC = {
+    b"\x89PNG\r\n\x1a\n": "png",
+    b"GIF87a": "gif",
+    b"GIF89a": "gif",
+    b"\xff\xd8": "jpg",
+    b"BM": "bmp",
+}
+# أطوال التوقيعات من الأطول للأقصر (بحث واحد في القاموس لكل طول)
+IMAGE_MAGIC_LENGTHS = sorted({len(magic) for magic in IMAGE_MAGIC}, reverse=True)
+
+# namespaces ملفات الـ drawing والـ rels داخل ملف xlsx (نقرأها مباشرة بدون كائنات openpyxl)
+XDR_NS = "{http://schemas.openxmlformats.org/drawingml/2006/spreadsheetDrawing}"
+A_NS = "{http://schemas.openxmlformats.org/drawingml/2006/main}"
+R_EMBED = "{http://schemas.openxmlformats.org/officeDocument/2006/relationships}embed"
+R_ID = "{http://schemas.openxmlformats.org/officeDocument/2006/relationships}id"
+MAIN_NS = "{http://schemas.openxmlformats.org/spreadsheetml/2006/main}"
+RELS_NS = "{http://schemas.openxmlformats.org/package/2006/relationships}"
+
+# أنواع الـ anchor بنفس أسماء كلاسات openpyxl (للّوغ)، وبنفس ترتيب openpyxl لقائمة ws._images
+ANCHOR_TAGS = {
+    XDR_NS + "absoluteAnchor": "AbsoluteAnchor",
+    XDR_NS + "oneCellAnchor": "OneCellAnchor",
+    XDR_NS + "twoCellAnchor": "TwoCellAnchor",
 }
 
+# صيغ يتعرف عليها PIL لكن openpyxl لا يحفظها كصور (كان يسقطها عند التحميل)
+SKIPPED_IMAGE_FORMATS = frozenset({"WMF"})
+
+# مقاس الصورة المصغّرة التي تُدرج في ملف الإخراج (نفس مقاس العرض في العمود B)
+PREVIEW_SIZE = (50, 50)
+
+# أشكال عنوان عمود رقم السطر (بعد strip + lower)، إضافة إلى "#"
+NO_HEADER_TOKENS = frozenset({"no", "no.", "no#", "no:"})
+
 # أكواد ألوان ANSI للّوغ (بدون مكتبات إضافية)
 RESET = "\033[0m"
 CYAN = "\033[36m"
@@ -43,25 +103,47 @@ GREEN = "\033[32m"
 RED = "\033[31m"
 MAGENTA = "\033[35m"
 
+# مستويات اللوغ: الرسائل الأقل من LOG_LEVEL لا تُطبع.
+# رسائل DEBUG تُكتب لكل باكج/صورة/دمج، لذلك نخفيها افتراضياً؛
+# اجعل LOG_LEVEL هو LOG_DEBUG لرؤية التفاصيل.
+LOG_DEBUG = 10
+LOG_INFO = 20
+LOG_WARN = 30
+LOG_ERROR = 40
+# يمكن تغييره بدون تعديل الكود: LOG_LEVEL=DEBUG (أو INFO / WARN / ERROR)
+LOG_LEVEL = {
+    "DEBUG": LOG_DEBUG,
+    "INFO": LOG_INFO,
+    "WARN": LOG_WARN,
+    "ERROR": LOG_ERROR,
+}.get(os.environ.get("LOG_LEVEL", "").strip().upper(), LOG_INFO)
+# نستخدمه في الحلقات قبل بناء نص الرسالة (f-string) حتى لا ندفع ثمنه بلا فائدة
+DEBUG_ENABLED = LOG_LEVEL <= LOG_DEBUG
+
 
 def log_info(msg: str) -> None:
-    print(f"{CYAN}[INFO]{RESET} {msg}")
+    if LOG_LEVEL <= LOG_INFO:
+        print(f"{CYAN}[INFO]{RESET} {msg}")
 
 
 def log_warn(msg: str) -> None:
-    print(f"{YELLOW}[WARN]{RESET} {msg}")
+    if LOG_LEVEL <= LOG_WARN:
+        print(f"{YELLOW}[WARN]{RESET} {msg}")
 
 
 def log_success(msg: str) -> None:
-    print(f"{GREEN}[OK]{RESET}   {msg}")
+    if LOG_LEVEL <= LOG_INFO:
+        print(f"{GREEN}[OK]{RESET}   {msg}")
 
 
 def log_error(msg: str) -> None:
-    print(f"{RED}[ERROR]{RESET} {msg}")
+    if LOG_LEVEL <= LOG_ERROR:
+        print(f"{RED}[ERROR]{RESET} {msg}")
 
 
 def log_debug(msg: str) -> None:
-    print(f"{MAGENTA}[DEBUG]{RESET} {msg}")
+    if LOG_LEVEL <= LOG_DEBUG:
+        print(f"{MAGENTA}[DEBUG]{RESET} {msg}")
 
 
 # ==========================
@@ -75,7 +157,14 @@ def to_int_or_none(value) -> Optional[int]:
     """
     if value is None:
         return None
+    # المسار السريع: الأرقام كما يرجعها openpyxl لا تحتاج str/strip/float
+    # (bool ليس رقماً هنا: str(True) لا يتحول إلى float فيرجع None كما كان)
+    value_type = type(value)
+    if value_type is int:
+        return value
     try:
+        if value_type is float:
+            return int(value)
         text = str(value).strip()
         if not text:
             return None
@@ -86,6 +175,16 @@ def to_int_or_none(value) -> Optional[int]:
         return None
 
 
+def new_uids(count: int) -> List[str]:
+    """
+    تولّد count من معرّفات UUID4 كنصوص.
+    نقرأ البايتات العشوائية دفعة واحدة (os.urandom واحد) بدل uuid4() لكل باكج؛
+    version=4 تضبط بتات النسخة والـ variant حسب RFC 4122.
+    """
+    raw = os.urandom(16 * count)
+    return [str(UUID(bytes=raw[i:i + 16], version=4)) for i in range(0, 16 * count, 16)]
+
+
 # ==========================
 # إدارة فولدر الصور
 # ==========================
@@ -96,78 +195,118 @@ def ensure_clean_images_dir() -> None:
     يعمل داخل IMAGES_DIR.
     """
     if os.path.isdir(IMAGES_DIR):
-        for name in os.listdir(IMAGES_DIR):
-            path = os.path.join(IMAGES_DIR, name)
-            if os.path.isfile(path):
-                os.remove(path)
+        # scandir يعطي نوع كل ملف مع القائمة نفسها بدون stat منفصل لكل ملف
+        with os.scandir(IMAGES_DIR) as entries:
+            for entry in entries:
+                if entry.is_file(follow_symlinks=False):
+                    os.remove(entry.path)
     else:
         os.makedirs(IMAGES_DIR, exist_ok=True)
 
     log_info(f"Images directory ready and cleaned: '{IMAGES_DIR}'")
 
 
-def get_image_bytes(img) -> Optional[bytes]:
+def read_image_bytes(archive: zipfile.ZipFile, image: Dict[str, Any]) -> Optional[bytes]:
     """
-    تحاول استخراج بايتات الصورة من كائن openpyxl Image.
-    نعتمد على الخاصية _data (قد تكون دالة أو بايتات جاهزة).
+    تقرأ بايتات الصورة من ملف الـ media داخل الـ xlsx (فقط للصور المستخدمة فعلاً).
     """
-    data_attr = getattr(img, "_data", None)
-
-    if callable(data_attr):
-        try:
-            return data_attr()
-        except Exception as e:
-            log_warn(f"Failed to call img._data(): {e}")
+    try:
+        return archive.read(image["target"])
+    except Exception as e:
+        log_warn(f"Failed to read image '{image['target']}': {e}")
+        return None
 
-    if isinstance(data_attr, (bytes, bytearray)):
-        return bytes(data_attr)
 
-    log_warn("Could not extract image bytes from Image object.")
+def guess_image_ext(data: bytes) -> Optional[str]:
+    """
+    تخمين بسيط لامتداد الصورة من أول بايتات بدون استخدام مكتبات إضافية.
+    بحث في جدول IMAGE_MAGIC لكل طول توقيع بدل سلسلة startswith.
+    لو ما عرفنا النوع نرجّع None (والمستدعي يستخدم الفورمات الذي عرفه PIL).
+    """
+    for length in IMAGE_MAGIC_LENGTHS:
+        ext = IMAGE_MAGIC.get(data[:length])
+        if ext is not None:
+            return ext
     return None
 
 
-def guess_image_ext(data: bytes) -> str:
+def identify_image(archive: zipfile.ZipFile, target: str) -> Optional[str]:
     """
-    تخمين بسيط لامتداد الصورة من أول بايتات بدون استخدام مكتبات إضافية.
-    لو ما عرفنا النوع نرجّع 'jpg' افتراضياً.
+    ترجع فورمات PIL (بحروف صغيرة) لملف الـ media، أو None لو الصورة تُسقط كما كان يفعل openpyxl:
+    PIL لا يقرؤها، أو فورماتها WMF. PIL يقرأ الهيدر فقط من الـ zip (بدون فك الصورة).
+    """
+    try:
+        with archive.open(target) as f, PILImage.open(f) as im:
+            fmt = im.format or ""
+    except Exception as e:
+        log_warn(f"The image {target} will be removed because it cannot be read: {e}")
+        return None
+
+    if fmt.upper() in SKIPPED_IMAGE_FORMATS:
+        log_warn(f"{fmt} image format is not supported so the image '{target}' is being dropped")
+        return None
+    return fmt.lower()
+
+
+def make_preview_bytes(data: bytes) -> bytes:
+    """
+    تصغير الصورة مرة واحدة إلى PREVIEW_SIZE (مع الحفاظ على النسبة) لإدراجها في الإكسل،
+    بدل تضمين الصورة الأصلية كاملة في كل صف. الصورة الأصلية تبقى كما هي في IMAGES_DIR.
+    لو فشل التصغير نرجّع البايتات الأصلية.
+    """
+    try:
+        with PILImage.open(io.BytesIO(data)) as im:
+            fmt = "JPEG" if im.format == "JPEG" else "PNG"
+            im.thumbnail(PREVIEW_SIZE, PILImage.LANCZOS)
+            buf = io.BytesIO()
+            im.save(buf, fmt)
+            return buf.getvalue()
+    except Exception as e:
+        log_warn(f"Failed to create image preview: {e}")
+        return data
+
+
+def write_image_file(path: str, data: bytes) -> None:
     """
-    if data.startswith(b"\x89PNG\r\n\x1a\n"):
-        return "png"
-    if data.startswith(b"\xff\xd8"):
-        return "jpg"
-    if data.startswith(b"GIF87a") or data.startswith(b"GIF89a"):
-        return "gif"
-    if data.startswith(b"BM"):
-        return "bmp"
-    return "jpg"
+    كتابة بايتات الصورة مباشرة عبر os.open / os.write بدون طبقة الـ buffering في بايثون
+    (البايتات جاهزة ومتصلة في الذاكرة أصلاً).
+    """
+    flags = os.O_WRONLY | os.O_CREAT | os.O_TRUNC | getattr(os, "O_BINARY", 0)
+    fd = os.open(path, flags, 0o644)
+    try:
+        view = memoryview(data)
+        while view:
+            written = os.write(fd, view)
+            view = view[written:]
+    finally:
+        os.close(fd)
 
 
 # ==========================
 # حساب إحداثيات Y للصفوف
 # ==========================
 
-def compute_row_y_map(ws):
+def compute_row_y_map(row_heights: Dict[int, float], default_height_points: float, max_row: int):
     """
     تحسب إحداثيات Y (بالـ EMU) لكل صف:
     top_y[row] = موضع بداية الصف من الأعلى
     bottom_y[row] = موضع نهاية الصف
-    نعتمد على ارتفاع الصفوف (إن كان مخصصاً) أو ارتفاع الديفولت من sheet_format.
+    نعتمد على ارتفاع الصفوف (إن كان مخصصاً) أو ارتفاع الديفولت (بالنقاط).
     """
-    sheet_format = ws.sheet_format
-    default_height_points = sheet_format.defaultRowHeight or 15  # نقاط
     EMU_PER_POINT = 12700  # ثابت تحويل من نقاط إلى EMU
 
-    top_y = {}
-    bottom_y = {}
-    acc = 0
+    # ارتفاع كل صف بالـ EMU: الديفولت للكل، ثم نمر فقط على الصفوف ذات الارتفاع المخصص
+    heights = [default_height_points * EMU_PER_POINT] * (max_row + 1)
+    for r, height in row_heights.items():
+        if 1 <= r <= max_row:
+            heights[r] = height * EMU_PER_POINT
 
-    for r in range(1, ws.max_row + 1):
-        h = ws.row_dimensions[r].height
-        if h is None:
-            h = default_height_points
-        top_y[r] = acc
-        acc += h * EMU_PER_POINT
-        bottom_y[r] = acc
+    # edges[r] = نهاية الصف r = بداية الصف r + 1 (مجموع تراكمي بدون حلقة بايثون)
+    edges = list(accumulate(heights[1:], initial=0))
+
+    # قوائم مفهرسة برقم الصف (1-based)، العنصر 0 غير مستخدم
+    top_y = [0] + edges[:-1]
+    bottom_y = edges
 
     log_info(
         f"Row Y mapping computed using default height {default_height_points} pt "
@@ -180,37 +319,55 @@ def compute_row_y_map(ws):
 # منطق استخراج الباكجات
 # ==========================
 
-def find_first_header_row(ws) -> int:
+def scan_first_column_and_header(grid: List[list]) -> Tuple[int, List[Tuple[int, Any]]]:
     """
-    تبحث عن أول سطر يحتوي على أي من الكلمات:
-    Part Number / Description / Qty
-    في أي عمود من الأعمدة، وترجع رقم السطر (1-based).
-    لو لم تجده ترجع 0.
+    مسح واحد للـ grid يرجع:
+    - رقم أول سطر يحتوي على أي من الكلمات Part Number / Description / Qty
+      في أي عمود (1-based)، أو 0 لو لم نجده.
+    - قيم العمود الأول غير الفارغة (row, value) ابتداءً من السطر الذي فوق الهيدر،
+      لكي لا تعيد build_packages المرور على نفس الأسطر.
     """
-    for row in range(1, ws.max_row + 1):
-        for col in range(1, ws.max_column + 1):
-            cell_value = ws.cell(row=row, column=col).value
-            if not cell_value:
+    header_row = 0
+    first_col_values: List[Tuple[int, Any]] = []
+
+    for row, values in enumerate(grid, start=1):
+        if not header_row:
+            for col, cell_value in enumerate(values, start=1):
+                # كلمات الهيدر نصوص فقط: الأرقام والتواريخ لا تحتاج تحويل ولا بحث
+                if not cell_value or not isinstance(cell_value, str):
+                    continue
+
+                # strip لا يغيّر نتيجة البحث عن كلمة داخل النص، فنكتفي بـ lower
+                if HEADER_RE.search(cell_value.lower()):
+                    log_info(
+                        f"First header row detected at row {row} "
+                        f"(col {col}) with value '{cell_value}'"
+                    )
+                    header_row = row
+                    break
+
+            if not header_row:
                 continue
 
-            text = str(cell_value).strip().lower()
-            if any(keyword in text for keyword in HEADER_KEYWORDS):
-                log_info(
-                    f"First header row detected at row {row} "
-                    f"(col {col}) with value '{cell_value}'"
-                )
-                return row
+            # السطر الذي فوق الهيدر هو بداية البحث عن الباكجات
+            if row > 1 and grid[row - 2][0] is not None:
+                first_col_values.append((row - 1, grid[row - 2][0]))
+
+        if values[0] is not None:
+            first_col_values.append((row, values[0]))
 
-    log_warn("No header row found with Part Number / Description / Qty in any column.")
-    return 0
+    if not header_row:
+        log_warn("No header row found with Part Number / Description / Qty in any column.")
 
+    return header_row, first_col_values
 
-def build_packages(ws, top_y, bottom_y) -> List[Dict[str, Any]]:
+
+def build_packages(grid: List[list], top_y, bottom_y) -> List[Dict[str, Any]]:
     """
     تبني قائمة الباكجات اعتماداً على العمود الأول.
     نفس المنطق السابق مع y_start و y_end.
     """
-    header_row = find_first_header_row(ws)
+    header_row, first_col_values = scan_first_column_and_header(grid)
     if header_row <= 1:
         log_error("Cannot determine package start row (header row not found or at first row).")
         return []
@@ -221,19 +378,19 @@ def build_packages(ws, top_y, bottom_y) -> List[Dict[str, Any]]:
     packages: List[Dict[str, Any]] = []
     current_package: Optional[Dict[str, Any]] = None
 
-    for row in range(start_row, ws.max_row + 1):
-        cell_value = ws.cell(row=row, column=1).value
-        if cell_value is None:
-            continue
+    max_row = len(grid)
 
+    for row, cell_value in first_col_values:
         text = str(cell_value).strip()
         lower_text = text.lower()
 
-        if any(keyword in lower_text for keyword in HEADER_KEYWORDS):
+        if HEADER_RE.search(lower_text):
             continue
 
-        if lower_text in EXCLUDED_PACKAGE_TOKENS:
-            log_debug(f"Ignoring error-like value at row {row}: '{text}'")
+        # كل قيم الخطأ تبدأ بـ '#'، فنفحص المجموعة فقط لهذه الحالة النادرة
+        if lower_text.startswith("#") and lower_text in EXCLUDED_PACKAGE_TOKENS:
+            if DEBUG_ENABLED:
+                log_debug(f"Ignoring error-like value at row {row}: '{text}'")
             continue
 
         if current_package is not None:
@@ -250,14 +407,16 @@ def build_packages(ws, top_y, bottom_y) -> List[Dict[str, Any]]:
             "y_end": None,
             "images": [],
             "abs_images": [],
+            "has_image": False,  # أول صورة فقط تُربط بالباكج
             "uid": None,
             "image_filename": None,
+            "image_bytes": None,
             "category": None,
         }
         # log_debug(f"New package detected at row {row}: '{text}'")
 
     if current_package is not None:
-        current_package["end_row"] = ws.max_row
+        current_package["end_row"] = max_row
         current_package["y_start"] = top_y[current_package["start_row"]]
         current_package["y_end"] = bottom_y[current_package["end_row"]]
         packages.append(current_package)
@@ -270,17 +429,24 @@ def build_packages(ws, top_y, bottom_y) -> List[Dict[str, Any]]:
     return packages
 
 
-def fill_packages_categories(ws, packages: List[Dict[str, Any]]) -> None:
+def fill_packages_categories(grid: List[list], packages: List[Dict[str, Any]]) -> None:
     """
     ملء Category من العمود F ضمن مدى أسطر كل باكج.
     """
     CATEGORY_COL = 6  # العمود F
 
+    # لو الشيت أضيق من العمود F فلا توجد فئات أصلاً
+    has_category_col = bool(grid) and len(grid[0]) >= CATEGORY_COL
+
     for pkg in packages:
         category = None
 
-        for row in range(pkg["start_row"], pkg["end_row"] + 1):
-            cell_value = ws.cell(row=row, column=CATEGORY_COL).value
+        if not has_category_col:
+            pkg["category"] = category
+            continue
+
+        for values in grid[pkg["start_row"] - 1:pkg["end_row"]]:
+            cell_value = values[CATEGORY_COL - 1]
             if isinstance(cell_value, str):
                 text = cell_value.strip()
                 if text:
@@ -288,17 +454,18 @@ def fill_packages_categories(ws, packages: List[Dict[str, Any]]) -> None:
                     break
 
         pkg["category"] = category
-        log_debug(
-            f"Package '{pkg['name']}' rows [{pkg['start_row']}-{pkg['end_row']}]: "
-            f"Category = '{category}'"
-        )
+        if DEBUG_ENABLED:
+            log_debug(
+                f"Package '{pkg['name']}' rows [{pkg['start_row']}-{pkg['end_row']}]: "
+                f"Category = '{category}'"
+            )
 
 
 # ==========================
 # اكتشاف أعمدة No / PartNo / Desc / QTY
 # ==========================
 
-def detect_detail_columns(ws, first_package: Dict[str, Any]) -> Optional[Tuple[int, int, int, int]]:
+def detect_detail_columns(grid: List[list], first_package: Dict[str, Any]) -> Optional[Tuple[int, int, int, int]]:
     """
     نبحث عن عمود رقم السطر (No) بهذه الأولوية:
     1) عمود عنوانه بالضبط "#"
@@ -313,44 +480,42 @@ def detect_detail_columns(ws, first_package: Dict[str, Any]) -> Optional[Tuple[i
     MAX_OFFSET_COLS = 5
     last_col_to_check = FIRST_DATA_COL + MAX_OFFSET_COLS - 1
 
-    candidate_no_cols = []
+    max_column = len(grid[0]) if grid else 0
 
-    for row in range(start_row, end_row + 1):
-        for col in range(FIRST_DATA_COL, last_col_to_check + 1):
-            cell_value = ws.cell(row=row, column=col).value
+    found: Optional[Tuple[int, int, str]] = None
+    for row, values in enumerate(grid[start_row - 1:end_row], start=start_row):
+        window = values[FIRST_DATA_COL - 1:last_col_to_check]
+        for col, cell_value in enumerate(window, start=FIRST_DATA_COL):
             if not isinstance(cell_value, str):
                 continue
 
             raw = cell_value.strip()
-            lower = raw.lower()
 
             # الشرط الجديد: إما بالضبط "#" أو "no" (مع بعض الأشكال البسيطة)
-            is_hash = (raw == "#")
-            is_no   = (lower in {"no", "no.", "no#", "no:"})
-
-            if not (is_hash or is_no):
-                continue
-
-            candidate_no_cols.append((row, col, raw))
-
-    if not candidate_no_cols:
+            if raw == "#" or raw.lower() in NO_HEADER_TOKENS:
+                # نكتفي بأول تطابق (أقرب شيء للأعلى) ونوقف المسح مباشرة
+                found = (row, col, raw)
+                break
+        if found is not None:
+            break
+
+    if found is None:
         log_warn(
             "Could not detect detail columns (No / Part Number / Description / QTY) "
             "inside the first package range."
         )
         return None
 
-    # لو وجدنا أكثر من واحد، نختار أول واحد (أقرب شيء للأعلى)
-    row, col_no, header_text = candidate_no_cols[0]
+    row, col_no, header_text = found
 
     col_part = col_no + 1
     col_desc = col_no + 2
     col_qty  = col_no + 3
 
-    if col_qty > ws.max_column:
+    if col_qty > max_column:
         log_warn(
             f"Detected No-like header '{header_text}' at col {col_no} row {row} "
-            f"but following columns exceed max_column={ws.max_column}."
+            f"but following columns exceed max_column={max_column}."
         )
         return None
 
@@ -365,54 +530,187 @@ def detect_detail_columns(ws, first_package: Dict[str, Any]) -> Optional[Tuple[i
 # ربط الصور بالباكجات
 # ==========================
 
-def find_package_for_row(packages: List[Dict[str, Any]], row: int) -> Optional[Dict[str, Any]]:
-    for pkg in packages:
-        if pkg["start_row"] <= row <= pkg["end_row"]:
-            return pkg
+def find_package_for_row(
+    packages: List[Dict[str, Any]],
+    row: int,
+    starts: Optional[List[int]] = None,
+) -> Optional[Dict[str, Any]]:
+    """
+    الباكجات مرتبة ومتتالية بدون تداخل، فنستخدم bisect على start_row بدل المرور على الكل.
+    starts يمكن تمريرها محسوبة مسبقاً عند استدعاء الدالة لعدة صور.
+    """
+    if starts is None:
+        starts = [pkg["start_row"] for pkg in packages]
+
+    i = bisect_right(starts, row) - 1
+    if i >= 0 and row <= packages[i]["end_row"]:
+        return packages[i]
     return None
 
 
-def find_package_for_y_center(packages: List[Dict[str, Any]], center_y: int) -> Optional[Dict[str, Any]]:
-    for pkg in packages:
-        if pkg["y_start"] is None or pkg["y_end"] is None:
-            continue
-        if pkg["y_start"] <= center_y < pkg["y_end"]:
-            return pkg
+def find_package_for_y_center(
+    packages: List[Dict[str, Any]],
+    center_y: float,
+    y_starts: Optional[List[float]] = None,
+) -> Optional[Dict[str, Any]]:
+    """
+    نفس فكرة find_package_for_row لكن على إحداثيات Y (y_start مرتبة تصاعدياً).
+    """
+    if y_starts is None:
+        y_starts = [pkg["y_start"] for pkg in packages]
+
+    i = bisect_right(y_starts, center_y) - 1
+    if i >= 0 and center_y < packages[i]["y_end"]:
+        return packages[i]
     return None
 
 
-def collect_worksheet_images(ws):
-    images = getattr(ws, "_images", [])
+def read_part_rels(archive: zipfile.ZipFile, part_path: str) -> Dict[str, Tuple[str, str]]:
+    """
+    تقرأ ملف الـ rels الخاص بجزء داخل الـ xlsx وترجع {rId: (النوع, المسار الكامل داخل الـ zip)}.
+    """
+    folder, name = posixpath.split(part_path)
+    rels_path = posixpath.join(folder, "_rels", name + ".rels")
+    try:
+        root = ET.fromstring(archive.read(rels_path))
+    except KeyError:
+        return {}
+
+    rels: Dict[str, Tuple[str, str]] = {}
+    for rel in root.iter(RELS_NS + "Relationship"):
+        if rel.get("TargetMode") == "External":
+            continue
+        target = rel.get("Target", "")
+        if target.startswith("/"):
+            target = target.lstrip("/")
+        else:
+            target = posixpath.normpath(posixpath.join(folder, target))
+        rels[rel.get("Id")] = (rel.get("Type", ""), target)
+    return rels
+
+
+def extract_drawing_anchors(
+    archive: zipfile.ZipFile,
+    drawing_path: str,
+    formats: Dict[str, Optional[str]],
+) -> List[Dict[str, Any]]:
+    """
+    تمر على ملف الـ drawing بـ iterparse وتأخذ من كل صورة فقط ما نحتاجه للربط:
+    {"kind", "row" (0-based من from), "y" (pos.y), "cy" (ext.cy), "target" (مسار ملف الـ media),
+     "format" (فورمات PIL)}.
+    البايتات نفسها لا تُقرأ هنا؛ الصور التي لا يتعرف عليها PIL تُسقط مثل openpyxl
+    (فتصبح الصورة التالية في الباكج هي المعتمدة). formats: كاش identify_image لكل ملف media.
+    """
+    media_rels = read_part_rels(archive, drawing_path)
+    by_kind: Dict[str, List[Dict[str, Any]]] = {kind: [] for kind in ANCHOR_TAGS.values()}
+
+    with archive.open(drawing_path) as f:
+        for _, elem in ET.iterparse(f):
+            kind = ANCHOR_TAGS.get(elem.tag)
+            if kind is None:
+                continue
+
+            pic = elem.find(XDR_NS + "pic")
+            if pic is None:
+                pic = elem.find(f"{XDR_NS}grpSp/{XDR_NS}pic")
+            blip = pic.find(f"{XDR_NS}blipFill/{A_NS}blip") if pic is not None else None
+            rel = media_rels.get(blip.get(R_EMBED)) if blip is not None else None
+
+            if rel is not None and rel[0].endswith("/image"):
+                if rel[1] not in formats:
+                    formats[rel[1]] = identify_image(archive, rel[1])
+                image_format = formats[rel[1]]
+            else:
+                image_format = None
+
+            if image_format is not None:
+                row = elem.findtext(f"{XDR_NS}from/{XDR_NS}row")
+                pos = elem.find(XDR_NS + "pos")
+                ext = elem.find(XDR_NS + "ext")
+                y = pos.get("y") if pos is not None else None
+                cy = ext.get("cy") if ext is not None else None
+                by_kind[kind].append({
+                    "kind": kind,
+                    "row": int(row) if row is not None else None,
+                    "y": int(y) if y is not None else None,
+                    "cy": int(cy) if cy is not None else None,
+                    "target": rel[1],
+                    "format": image_format,
+                })
+            elem.clear()
+
+    # نفس ترتيب openpyxl: absolute ثم oneCell ثم twoCell (أول صورة لكل باكج هي المعتمدة)
+    return [image for kind_images in by_kind.values() for image in kind_images]
+
+
+def find_active_sheet_path(archive: zipfile.ZipFile) -> Optional[str]:
+    """
+    مسار ملف XML للشيت النشطة داخل الـ zip (نفس الشيت التي يرجعها wb.active في openpyxl):
+    _rels/.rels → workbook.xml → activeTab في bookViews → rId الشيت → مساره من rels الـ workbook.
+    ترجع None لو لم نجدها.
+    """
+    workbook_path = None
+    for rel_type, target in read_part_rels(archive, "").values():
+        if rel_type.endswith("/officeDocument"):
+            workbook_path = target
+            break
+    if workbook_path is None:
+        return None
+
+    root = ET.fromstring(archive.read(workbook_path))
+    view = root.find(f"{MAIN_NS}bookViews/{MAIN_NS}workbookView")
+    active_tab = int(view.get("activeTab", 0)) if view is not None else 0
+
+    sheets = root.findall(f"{MAIN_NS}sheets/{MAIN_NS}sheet")
+    if not 0 <= active_tab < len(sheets):
+        return None
+
+    rel = read_part_rels(archive, workbook_path).get(sheets[active_tab].get(R_ID))
+    return rel[1] if rel is not None else None
+
+
+def collect_worksheet_images(archive: zipfile.ZipFile, sheet_path: str) -> List[Dict[str, Any]]:
+    images: List[Dict[str, Any]] = []
+    formats: Dict[str, Optional[str]] = {}
+    for rel_type, target in read_part_rels(archive, sheet_path).values():
+        if rel_type.endswith("/drawing"):
+            images.extend(extract_drawing_anchors(archive, target, formats))
     log_info(f"Total images found: {len(images)}")
-    log_info(f"Anchor types count: {Counter(type(img.anchor).__name__ for img in images)}")
     return images
 
 
-def map_images_to_packages(images, packages: List[Dict[str, Any]]) -> List[int]:
+def map_images_to_packages(images: List[Dict[str, Any]], packages: List[Dict[str, Any]]) -> List[int]:
     unmatched_images: List[int] = []
 
+    # حدود الباكجات مرتبة لأن build_packages تضيفها بترتيب الأسطر
+    starts = [pkg["start_row"] for pkg in packages]
+    y_starts = [pkg["y_start"] for pkg in packages]
+
+    # عدد الصور حسب نوع الـ anchor (للّوغ فقط) نحسبه داخل نفس الحلقة بدل لفّة إضافية
+    anchor_counts: Dict[str, int] = {}
+
     for idx, img in enumerate(images):
-        anchor = img.anchor
-        tname = type(anchor).__name__
+        tname = img["kind"]
+        anchor_counts[tname] = anchor_counts.get(tname, 0) + 1
 
-        if tname in ["OneCellAnchor", "TwoCellAnchor"] and hasattr(anchor, "_from") and anchor._from is not None:
-            fm = anchor._from
-            row_zero_based = getattr(fm, "row", 0)
-            row_excel = row_zero_based + 1
+        if tname in ["OneCellAnchor", "TwoCellAnchor"] and img["row"] is not None:
+            row_excel = img["row"] + 1
 
-            pkg = find_package_for_row(packages, row_excel)
+            pkg = find_package_for_row(packages, row_excel, starts)
             if pkg:
-                if pkg["images"] or pkg["abs_images"]:
+                if pkg["has_image"]:
                     log_warn(
                         f"Ignoring extra image #{idx} for package '{pkg['name']}' "
                         f"(already has an image)."
                     )
                 else:
                     pkg["images"].append(idx)
-                    log_success(
-                        f"Image #{idx} (OneCellAnchor at row {row_excel}) linked to package "
-                        f"'{pkg['name']}' [rows {pkg['start_row']} - {pkg['end_row']}]"
-                    )
+                    pkg["has_image"] = True
+                    if DEBUG_ENABLED:
+                        log_debug(
+                            f"Image #{idx} (OneCellAnchor at row {row_excel}) linked to package "
+                            f"'{pkg['name']}' [rows {pkg['start_row']} - {pkg['end_row']}]"
+                        )
             else:
                 unmatched_images.append(idx)
                 log_warn(
@@ -421,19 +719,9 @@ def map_images_to_packages(images, packages: List[Dict[str, Any]]) -> List[int]:
                 )
             continue
 
-        if tname == "AbsoluteAnchor" and hasattr(anchor, "pos") and anchor.pos is not None:
-            pos = anchor.pos
-            ext = getattr(anchor, "ext", None)
-
-            if ext is None:
-                unmatched_images.append(idx)
-                log_warn(
-                    f"Image #{idx} (AbsoluteAnchor) has no ext; skipped for package mapping."
-                )
-                continue
-
-            y_top = getattr(pos, "y", None)
-            cy = getattr(ext, "cy", None)
+        if tname == "AbsoluteAnchor":
+            y_top = img["y"]
+            cy = img["cy"]
 
             if y_top is None or cy is None:
                 unmatched_images.append(idx)
@@ -443,20 +731,22 @@ def map_images_to_packages(images, packages: List[Dict[str, Any]]) -> List[int]:
                 continue
 
             center_y = y_top + cy / 2
-            pkg = find_package_for_y_center(packages, center_y)
+            pkg = find_package_for_y_center(packages, center_y, y_starts)
 
             if pkg:
-                if pkg["images"] or pkg["abs_images"]:
+                if pkg["has_image"]:
                     log_warn(
                         f"Ignoring extra image #{idx} for package '{pkg['name']}' "
                         f"(already has an image)."
                     )
                 else:
                     pkg["abs_images"].append(idx)
-                    log_success(
-                        f"Image #{idx} (AbsoluteAnchor center_y={center_y:.0f}) linked to package "
-                        f"'{pkg['name']}' [Y {pkg['y_start']:.0f} - {pkg['y_end']:.0f}]"
-                    )
+                    pkg["has_image"] = True
+                    if DEBUG_ENABLED:
+                        log_debug(
+                            f"Image #{idx} (AbsoluteAnchor center_y={center_y:.0f}) linked to package "
+                            f"'{pkg['name']}' [Y {pkg['y_start']:.0f} - {pkg['y_end']:.0f}]"
+                        )
             else:
                 unmatched_images.append(idx)
                 log_warn(
@@ -468,59 +758,100 @@ def map_images_to_packages(images, packages: List[Dict[str, Any]]) -> List[int]:
         unmatched_images.append(idx)
         log_warn(f"Image #{idx} with anchor type '{tname}' could not be processed for mapping.")
 
+    log_info(f"Anchor types count: {anchor_counts}")
     return unmatched_images
 
 
-def assign_uids_and_save_images(images, packages: List[Dict[str, Any]]) -> None:
+def save_package_image(img_bytes: bytes, uid: str, image_format: Optional[str]) -> Tuple[str, bytes]:
+    """
+    تكتب بايتات صورة واحدة في IMAGES_DIR باسم uid.
+    الامتداد من التوقيع (guess_image_ext)، وإلا من فورمات PIL؛ ولو لم نعرفه لا نكتب ملفاً.
+    ترجع (اسم الملف, بايتات الصورة المصغّرة للإدراج).
+    أخطاء الكتابة تُرفع للمستدعي.
+    """
+    ext = guess_image_ext(img_bytes)
+    if ext is None and image_format:
+        ext = "jpg" if image_format in ("jpeg", "jpg") else image_format
+    if ext is None:
+        raise ValueError("unknown image format")
+    filename = f"{uid}.{ext}"
+    write_image_file(os.path.join(IMAGES_DIR, filename), img_bytes)
+    return filename, make_preview_bytes(img_bytes)
+
+
+def assign_uids_and_save_images(
+    archive: zipfile.ZipFile,
+    images: List[Dict[str, Any]],
+    packages: List[Dict[str, Any]],
+) -> None:
     # log_info("=== Package list (id + optional image) ===")
     # print("package_name\tstart_row\tid\timage")
 
-    for pkg in packages:
+    # أولاً: uid لكل باكج وتحديد الصورة المختارة (في الـ thread الرئيسي)
+    tasks = []
+    uids = new_uids(len(packages))
+    for pkg, uid in zip(packages, uids):
         img_idx = None
         if pkg["images"]:
             img_idx = pkg["images"][0]
         elif pkg["abs_images"]:
             img_idx = pkg["abs_images"][0]
 
-        uid = str(uuid4())
-        filename = None
-
-        if img_idx is not None:
-            img_obj = images[img_idx]
-            img_bytes = get_image_bytes(img_obj)
+        pkg["uid"] = uid
+        pkg["image_filename"] = None
+        pkg["image_bytes"] = None
 
-            if not img_bytes:
-                log_warn(
-                    f"Image bytes for image #{img_idx} (package '{pkg['name']}') "
-                    f"could not be extracted."
-                )
-            else:
-                ext = guess_image_ext(img_bytes)
-                filename = f"{uid}.{ext}"
-                filepath = os.path.join(IMAGES_DIR, filename)
+        if img_idx is None:
+            continue
 
-                try:
-                    with open(filepath, "wb") as f:
-                        f.write(img_bytes)
+        # نقرأ من الـ zip فقط بايتات الصور المختارة (الـ ZipFile واحد، فالقراءة هنا وليس في الـ threads)
+        img_bytes = read_image_bytes(archive, images[img_idx])
+        if not img_bytes:
+            log_warn(
+                f"Image bytes for image #{img_idx} (package '{pkg['name']}') "
+                f"could not be extracted."
+            )
+            continue
+        tasks.append((pkg, img_bytes, images[img_idx]["format"]))
 
-                    # log_success(
-                    #     f"Saved image #{img_idx} for package '{pkg['name']}' "
-                    #     f"as '{filename}'"
-                    # )
-                except Exception as e:
-                    log_error(f"Failed to save image for package '{pkg['name']}': {e}")
-                    filename = None
+    if not tasks:
+        return
 
-        pkg["uid"] = uid
-        pkg["image_filename"] = filename
+    # ثانياً: الكتابة على الديسك والتصغير بالتوازي (كل صورة مستقلة عن الأخرى،
+    # والـ GIL يتحرر أثناء الكتابة ومعالجة الصورة). اللوغ يبقى في الـ thread الرئيسي.
+    max_workers = min(32, (os.cpu_count() or 1) * 4, len(tasks))
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = [
+            executor.submit(save_package_image, img_bytes, pkg["uid"], image_format)
+            for pkg, img_bytes, image_format in tasks
+        ]
+
+        for (pkg, _, _), future in zip(tasks, futures):
+            try:
+                saved = future.result()
+            except Exception as e:
+                log_error(f"Failed to save image for package '{pkg['name']}': {e}")
+                continue
 
-        # print(f"{pkg['name']}\t{pkg['start_row']}\t{uid}\t{filename or ''}")
+            # نحتفظ بالبايتات في الذاكرة لإدراجها في ملف الخرج بدون إعادة قراءتها من الديسك
+            pkg["image_filename"], pkg["image_bytes"] = saved
 
 
-def link_images_to_packages(ws, packages: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
-    images = collect_worksheet_images(ws)
-    unmatched_images = map_images_to_packages(images, packages)
-    assign_uids_and_save_images(images, packages)
+def link_images_to_packages(path: str, packages: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    # نقرأ الـ anchors وملفات الـ media مباشرة من الـ zip بدل كائنات Image في openpyxl
+    with zipfile.ZipFile(path) as archive:
+        # ملف drawing أو rels تالف/ناقص لا يجب أن يوقف الملف كله: نكمل الأسطر بدون صور
+        try:
+            sheet_path = find_active_sheet_path(archive)
+            images = collect_worksheet_images(archive, sheet_path) if sheet_path else []
+        except (KeyError, ET.ParseError, ValueError, zipfile.BadZipFile) as e:
+            log_error(
+                f"Failed to read images from '{os.path.basename(path)}': {e}. "
+                f"Continuing without images."
+            )
+            images = []
+        unmatched_images = map_images_to_packages(images, packages)
+        assign_uids_and_save_images(archive, images, packages)
 
     if unmatched_images:
         log_warn(f"Unmatched images: {unmatched_images}")
@@ -531,130 +862,118 @@ def link_images_to_packages(ws, packages: List[Dict[str, Any]]) -> List[Dict[str
 # ==========================
 # فك الدمج العمودي (forward-fill) في أعمدة التفاصيل
 # ==========================
-def flatten_vertical_merges_in_column(ws, col: int) -> None:
+def index_vertical_merges_by_column(merged_ranges) -> Dict[int, List[Tuple[int, int]]]:
     """
-    يفك الدمج العمودي في عمود واحد (مثل عمود No أو QTY):
-    - يبحث في ws.merged_cells عن أي range من نوع عمودي في هذا العمود (min_col == max_col == col)
-    - يأخذ قيمة الخلية الأولى (أعلى سطر في الدمج)
-    - يعمل unmerge للـ range
-    - يكتب نفس القيمة في كل الأسطر ضمن هذا الدمج لهذا العمود
+    مرور واحد على نطاقات الدمج: {col: [(min_row, max_row), ...]}
+    فقط للدمج العمودي داخل عمود واحد (min_col == max_col و max_row > min_row).
     """
-    # نأخذ نسخة من القائمة لأننا سنعدل الـ merged_cells أثناء الدوران
-    merged_ranges = list(ws.merged_cells.ranges)
-
+    by_col: Dict[int, List[Tuple[int, int]]] = {}
     for merged_range in merged_ranges:
-        min_row = merged_range.min_row
-        max_row = merged_range.max_row
         min_col = merged_range.min_col
-        max_col = merged_range.max_col
+        if min_col == merged_range.max_col and merged_range.max_row > merged_range.min_row:
+            by_col.setdefault(min_col, []).append((merged_range.min_row, merged_range.max_row))
+    return by_col
 
-        # نهتم فقط بحالات الدمج العمودي في هذا العمود بالذات
-        if min_col == max_col == col and max_row > min_row:
-            # قيمة الخلية الأصلية (أعلى الخلية في الدمج)
-            value = ws.cell(row=min_row, column=col).value
 
-            # نفك الدمج
-            ws.unmerge_cells(str(merged_range))
+def flatten_vertical_merges_in_column(
+    grid: List[list],
+    merges_by_col: Dict[int, List[Tuple[int, int]]],
+    col: int,
+) -> None:
+    """
+    يفك الدمج العمودي في عمود واحد (مثل عمود No أو QTY):
+    - يأخذ من merges_by_col نطاقات الدمج العمودي في هذا العمود فقط
+    - يأخذ قيمة الخلية الأولى (أعلى سطر في الدمج)
+    - يكتب نفس القيمة في كل الأسطر ضمن هذا الدمج لهذا العمود داخل الـ grid
+    الشيت الأصلي لا يُحفظ، لذلك لا نحتاج unmerge في openpyxl نفسه.
+    """
+    for min_row, max_row in merges_by_col.get(col, ()):
+        # قيمة الخلية الأصلية (أعلى الخلية في الدمج)
+        value = grid[min_row - 1][col - 1]
 
-            # ننسخ القيمة على كل الأسطر في هذا العمود
-            if value is not None and str(value).strip() != "":
-                for row in range(min_row, max_row + 1):
-                    ws.cell(row=row, column=col).value = value
+        # ننسخ القيمة على كل الأسطر في هذا العمود
+        if value is not None and str(value).strip() != "":
+            for row in range(min_row, max_row + 1):
+                grid[row - 1][col - 1] = value
 
+        if DEBUG_ENABLED:
             log_debug(
                 f"Flattened vertical merge in col {col} "
                 f"rows [{min_row}-{max_row}] with value '{value}'"
             )
 
 
-def forward_fill_column_in_range(ws, col: int, start_row: int, end_row: int) -> None:
-    last_value = None
-
-    for row in range(start_row, end_row + 1):
-        cell = ws.cell(row=row, column=col)
-        value = cell.value
-
-        if value is not None and str(value).strip() != "":
-            last_value = value
+def column_texts(grid: List[list], col: int) -> List[str]:
+    """
+    نص كل خلية في العمود بعد str + strip ("" للخلية الفارغة)، بنفس ترتيب أسطر الـ grid.
+    يُحسب مرة واحدة لعمودي Part و Desc (لا يتغيران بفك الدمج أو الـ forward-fill)
+    ويُستخدم في تحديد أسطر الداتا وفي بناء أسطر الإخراج بدل تكرار str().strip().
+    """
+    c = col - 1
+    texts = []
+    for values in grid:
+        value = values[c]
+        if value is None:
+            texts.append("")
+        elif isinstance(value, str):
+            texts.append(value.strip())
         else:
-            if last_value is not None:
-                cell.value = last_value
+            texts.append(str(value).strip())
+    return texts
 
 
-def find_data_rows_range_for_package(
-    ws,
-    pkg: Dict[str, Any],
-    col_part: int,
-    col_desc: int,
-) -> Optional[Tuple[int, int]]:
+def compute_all_data_ranges(
+    part_texts: List[str],
+    desc_texts: List[str],
+    packages: List[Dict[str, Any]],
+) -> Dict[int, Tuple[int, int]]:
     """
-    يحدد نطاق أسطر البيانات (parts) لكل باكج:
-    - أي سطر فيه Part Number أو Description نعتبره داتا.
-    - يرجع (data_start, data_end) أو None لو لم يوجد داتا.
+    يحدد نطاق أسطر البيانات (parts) لكل الباكجات في مرور واحد على الأسطر:
+    - أي سطر فيه Part Number أو Description نعتبره داتا، ونحدد باكجه بـ bisect على start_row.
+    - يرجع {package_index: (data_start, data_end)}؛ الباكج بدون داتا لا تظهر فيه.
     هذا يحاكي منطق data_rows في كود pandas القديم.
     """
-    data_start = None
-    data_end = None
-
-    for row in range(pkg["start_row"], pkg["end_row"] + 1):
-        part_val = ws.cell(row=row, column=col_part).value
-        desc_val = ws.cell(row=row, column=col_desc).value
-
-        has_part = (
-            part_val is not None and str(part_val).strip() != ""
-        )
-        has_desc = (
-            desc_val is not None and str(desc_val).strip() != ""
-        )
-
-        if has_part or has_desc:
-            if data_start is None:
-                data_start = row
-            data_end = row
-
-    if data_start is None or data_end is None:
-        return None
+    starts = [pkg["start_row"] for pkg in packages]
+    ranges: Dict[int, List[int]] = {}
+
+    for row in range(packages[0]["start_row"], packages[-1]["end_row"] + 1):
+        if part_texts[row - 1] or desc_texts[row - 1]:
+            idx = bisect_right(starts, row) - 1
+            rng = ranges.get(idx)
+            if rng is None:
+                ranges[idx] = [row, row]
+            else:
+                rng[1] = row
 
-    return data_start, data_end
+    return {idx: (data_start, data_end) for idx, (data_start, data_end) in ranges.items()}
 
 
 def normalize_merged_detail_cells_for_all_packages(
-    ws,
+    grid: List[list],
+    merged_ranges,
     packages: List[Dict[str, Any]],
     col_no: int,
-    col_part: int,
-    col_desc: int,
+    part_texts: List[str],
+    desc_texts: List[str],
     col_qty: int,
 ) -> Dict[int, Tuple[int, int]]:
     """
-    تعوّض الدمج العمودي داخل أعمدة تفاصيل القطع ضمن مجال أسطر الداتا لكل باكج.
+    تعوّض الدمج العمودي داخل أعمدة تفاصيل القطع (No و QTY) في الـ grid،
+    وتحدد مجال أسطر الداتا لكل باكج. الـ forward-fill يتم لاحقاً أثناء بناء الأسطر.
     ترجع dict يربط package_index → (data_start, data_end) لاستخدامه لاحقاً.
     """
 
     # أولاً: نفك الدمج العمودي في عمودي No و QTY على مستوى الشيت كله
     # (لأن نفس الدمج قد يمر بعدة باكجات، وأسهل نفكه مرة واحدة)
-    flatten_vertical_merges_in_column(ws, col_no)
-    flatten_vertical_merges_in_column(ws, col_qty)
+    merges_by_col = index_vertical_merges_by_column(merged_ranges)
+    flatten_vertical_merges_in_column(grid, merges_by_col, col_no)
+    flatten_vertical_merges_in_column(grid, merges_by_col, col_qty)
 
-    data_ranges: Dict[int, Tuple[int, int]] = {}
+    data_ranges = compute_all_data_ranges(part_texts, desc_texts, packages)
 
     for idx, pkg in enumerate(packages):
-        res = find_data_rows_range_for_package(ws, pkg, col_part, col_desc)
-        if res is None:
+        if idx not in data_ranges:
             log_warn(f"No data rows found for package '{pkg['name']}'.")
-            continue
-
-        data_start, data_end = res
-        data_ranges[idx] = (data_start, data_end)
-
-        # بعد فك الدمج، نعمل forward-fill ضمن نطاق بيانات القطع فقط
-        forward_fill_column_in_range(ws, col_no, data_start, data_end)
-        forward_fill_column_in_range(ws, col_qty, data_start, data_end)
-
-        log_debug(
-            f"Forward-filled No/QTY for package '{pkg['name']}' "
-            f"rows [{data_start}-{data_end}]."
-        )
 
     return data_ranges
 
@@ -669,33 +988,34 @@ def process_workbook(path: str) -> List[tuple]:
     - تبني الباكجات + الفئات + الصور + الأعمدة التفصيلية + فك الدمج
     - تبني أسطر القطع لكل باكج:
       (PackageId, ImagePath, TitleTrim, PackageName,
-       No, PartNo, PartNameAndStandard, QTY, Category)
+       No, PartNo, PartNameAndStandard, QTY, Category, ImageBytes)
     """
     basename = os.path.basename(path)
     title_trim = os.path.splitext(basename)[0].strip()
 
     log_info(f"Opening workbook: {basename}")
 
+    # القيم والدمج وارتفاعات الصفوف نقرؤها في مرور واحد (بدون كائنات Cell ولا Image)،
+    # والصور نقرؤها لاحقاً من الـ zip مباشرة.
+    # كل التوابع بعدها تقرأ وتكتب في الـ grid بدل ws.cell() لكل خلية
     try:
-        wb = load_workbook(path, data_only=True)
+        grid, merged_ranges, row_heights, default_height = read_sheet_data(path, log_warn)
     except Exception as e:
         log_error(f"Failed to open '{basename}': {e}")
         return []
 
-    ws = wb.active
-
-    top_y, bottom_y = compute_row_y_map(ws)
+    top_y, bottom_y = compute_row_y_map(row_heights, default_height, len(grid))
 
-    packages = build_packages(ws, top_y, bottom_y)
+    packages = build_packages(grid, top_y, bottom_y)
     if not packages:
         log_warn(f"No packages found in '{basename}'.")
         return []
 
-    fill_packages_categories(ws, packages)
+    fill_packages_categories(grid, packages)
 
-    link_images_to_packages(ws, packages)
+    link_images_to_packages(path, packages)
 
-    detail_cols = detect_detail_columns(ws, packages[0])
+    detail_cols = detect_detail_columns(grid, packages[0])
     if detail_cols is None:
         log_warn(
             f"Detail columns could not be detected in '{basename}'. "
@@ -706,27 +1026,40 @@ def process_workbook(path: str) -> List[tuple]:
         for pkg in packages:
             uid = pkg.get("uid")
             image_filename = pkg.get("image_filename") or ""
+            image_bytes = pkg.get("image_bytes")
             pkg_name = pkg["name"]
             category = pkg.get("category") or ""
             rows_for_excel.append(
-                (uid, image_filename, title_trim, pkg_name, "", "", "", "", category)
+                (uid, image_filename, title_trim, pkg_name, "", "", "", "", category, image_bytes)
             )
         return rows_for_excel
 
     col_no, col_part, col_desc, col_qty = detail_cols
 
-    # نطبّق forward-fill على No و QTY ضمن مدى أسطر الداتا لكل باكج
+    # نص Part و Desc منظّف مرة واحدة لكل الشيت
+    part_texts = column_texts(grid, col_part)
+    desc_texts = column_texts(grid, col_desc)
+
+    # نفك دمج No و QTY ونحدد مدى أسطر الداتا لكل باكج
     data_ranges_by_pkg_index = normalize_merged_detail_cells_for_all_packages(
-        ws,
+        grid,
+        merged_ranges,
         packages,
         col_no,
-        col_part,
-        col_desc,
+        part_texts,
+        desc_texts,
         col_qty,
     )
 
     rows_for_excel: List[tuple] = []
 
+    c_no = col_no - 1
+    c_qty = col_qty - 1
+
+    # أسماء محلية لما يُستدعى في كل سطر (بدل البحث في globals وعن append في كل مرة)
+    to_int = to_int_or_none
+    append_row = rows_for_excel.append
+
     # نمر على كل باكج ونبني أسطر القطع
     for idx, pkg in enumerate(packages):
         if idx not in data_ranges_by_pkg_index:
@@ -737,32 +1070,45 @@ def process_workbook(path: str) -> List[tuple]:
 
         uid = pkg.get("uid")
         image_filename = pkg.get("image_filename") or ""
+        image_bytes = pkg.get("image_bytes")
         pkg_name = pkg["name"]
         category = pkg.get("category") or ""
 
+        # forward-fill لعمودي No و QTY ضمن مجال الداتا في نفس مرور بناء الأسطر:
+        # الخلية الفارغة (None أو نص فارغ بعد strip) تأخذ آخر قيمة غير فارغة فوقها
+        last_no = None
+        last_qty = None
+
         for row in range(data_start, data_end + 1):
-            no_val = ws.cell(row=row, column=col_no).value
-            part_val = ws.cell(row=row, column=col_part).value
-            desc_val = ws.cell(row=row, column=col_desc).value
-            qty_val = ws.cell(row=row, column=col_qty).value
+            values = grid[row - 1]
+
+            no_val = values[c_no]
+            if no_val is None or (isinstance(no_val, str) and not no_val.strip()):
+                no_val = last_no
+            else:
+                last_no = no_val
+
+            qty_val = values[c_qty]
+            if qty_val is None or (isinstance(qty_val, str) and not qty_val.strip()):
+                qty_val = last_qty
+            else:
+                last_qty = qty_val
+
+            part_str = part_texts[row - 1]
+            desc_str = desc_texts[row - 1]
 
             # نتأكد أن السطر فيه Part أو Description
-            has_part = part_val is not None and str(part_val).strip() != ""
-            has_desc = desc_val is not None and str(desc_val).strip() != ""
-            if not (has_part or has_desc):
+            if not (part_str or desc_str):
                 continue
 
             # رقم الـ No يجب أن يكون عدداً صحيحاً (مثل النسخة القديمة)
-            no_int = to_int_or_none(no_val)
+            no_int = to_int(no_val)
             if no_int is None:
                 continue
 
-            qty_int = to_int_or_none(qty_val)
-
-            part_str = str(part_val).strip() if part_val is not None else ""
-            desc_str = str(desc_val).strip() if desc_val is not None else ""
+            qty_int = to_int(qty_val)
 
-            rows_for_excel.append(
+            append_row(
                 (
                     uid,            # PackageId
                     image_filename, # ImagePath
@@ -773,114 +1119,104 @@ def process_workbook(path: str) -> List[tuple]:
                     desc_str,       # Part Name And Standard
                     qty_int,        # QTY
                     category,       # Category
+                    image_bytes,    # بايتات الصورة (للإدراج فقط، لا تُكتب كعمود)
                 )
             )
 
     return rows_for_excel
 
 
-# ==========================
-# الدالة الرئيسية
-# ==========================
-def main():
+def process_file(full_path: str) -> List[tuple]:
     """
-    - يحضّر فولدر الصور.
-    - يعالج كل ملف .xlsx في ROOT_DIR وفي المجلدات الفرعية داخله.
-    - يبني ملف إكسل جديد packages_data.xlsx
-      يحتوي أسطر القطع مع تكرار بيانات الباكج لكل سطر.
-    - يضع الصورة في عمود مستقل (B) واسم الملف في عمود مستقل (C).
-    - يترك سطرًا فارغًا بعد أسطر كل باكج قبل بدء الباكج التالية.
+    تُنفَّذ داخل process منفصل: تطبع عنوان الملف ثم تعالجه.
     """
-    ensure_clean_images_dir()
+    print()
+    rel = os.path.relpath(full_path, ROOT_DIR)
+    print(f"{MAGENTA}========== Processing file: {rel} =========={RESET}")
+    # أي خطأ غير متوقع في ملف واحد لا يجب أن يوقف باقي الملفات (ولا يترك ملف إخراج ناقصاً)
+    try:
+        return process_workbook(full_path)
+    except Exception as e:
+        log_error(f"Failed to process '{rel}': {e}. Skipping.")
+        return []
 
-    # نجمع كل ملفات .xlsx في ROOT_DIR وفي كل المجلدات الفرعية
-    xlsx_files: List[str] = []
-    for dirpath, _, filenames in os.walk(ROOT_DIR):
-        for name in filenames:
-            lower = name.lower()
-            if not lower.endswith(".xlsx"):
-                continue
-            if name.startswith("~$"):
-                # ملفات مؤقتة لإكسل
-                continue
-            xlsx_files.append(os.path.join(dirpath, name))
 
-    if not xlsx_files:
-        log_error(f"No .xlsx files found under ROOT_DIR: {ROOT_DIR}")
-        return
+def make_row_image(cache: Dict[str, XLImage], filename: str, image_bytes: bytes) -> XLImage:
+    """
+    ترجع XLImage جديد (لكل صف anchor خاص به) لصورة الباكج:
+    التحليل بـ PIL (المقاس والصيغة) يتم مرة واحدة لكل filename ويُخزّن في cache،
+    والنسخ تُرجع البايتات مباشرة عند الحفظ بدل فتحها بـ PIL مرة أخرى
+    (فقط للصيغ التي يحفظها openpyxl كما هي بدون تحويل).
+    """
+    proto = cache.get(filename)
+    if proto is None:
+        proto = XLImage(io.BytesIO(image_bytes))
+        cache[filename] = proto
+
+    if proto.format not in ("gif", "jpeg", "png"):
+        return XLImage(io.BytesIO(image_bytes))
+
+    xl_img = copy.copy(proto)
+    xl_img._data = lambda: image_bytes
+    return xl_img
 
-    log_info(f"Found {len(xlsx_files)} .xlsx file(s) under ROOT_DIR: {ROOT_DIR}")
-    for path in xlsx_files:
-        rel = os.path.relpath(path, ROOT_DIR)
-        log_debug(f"- {rel}")
-
-    all_rows: List[tuple] = []
-
-    # معالجة كل ملف إكسل وجمع كل أسطر الداتا
-    for full_path in xlsx_files:
-        print()
-        rel = os.path.relpath(full_path, ROOT_DIR)
-        print(f"{MAGENTA}========== Processing file: {rel} =========={RESET}")
-        rows = process_workbook(full_path)
-        all_rows.extend(rows)
-
-    if not all_rows:
-        log_warn("No rows were collected. Excel data file will not be created.")
-        return
 
-    # إنشاء ملف الإكسل الناتج
-    wb_out = Workbook()
-    ws_out = wb_out.active
-    ws_out.title = "packages"
-
-    # عرض الأعمدة
-    ws_out.column_dimensions["A"].width = 40
-    ws_out.column_dimensions["B"].width = 9
-    ws_out.column_dimensions["C"].width = 10
-    ws_out.column_dimensions["D"].width = 30
-    ws_out.column_dimensions["E"].width = 30
-    ws_out.column_dimensions["F"].width = 5
-    ws_out.column_dimensions["G"].width = 18
-    ws_out.column_dimensions["H"].width = 20
-    ws_out.column_dimensions["I"].width = 4
-
-
-    # الهيدر
-    header = [
-        "PackageId",
-        "Image",       # عمود معاينة الصورة
-        "ImagePath",   # اسم ملف الصورة (نصي فقط)
-        "Title - TRIM",
-        "PackageName",
-        "No",
-        "PartNo",
-        "Part Name And Standard",
-        "QTY",
-        "Category",
-        "delete",
-        "price",
-        "Description",
-        "Old Part No.",
-        "Names and specifications of old parts",
-        "note",
-        "is_red",
-        "is_line",
-        "is_deleted",
-        "is_orange",
-        "is_pink",
-        "is_yellow",
-        "internal_notes",
-    ]
-    ws_out.append(header)
-
-    # عدد الأعمدة (نستخدمه عندما نضيف سطر فارغ)
-    num_cols = len(header)
+# ==========================
+# كتابة ملف الإخراج
+# ==========================
+
+# عرض الأعمدة
+OUTPUT_COLUMN_WIDTHS = {
+    "A": 40,
+    "B": 9,
+    "C": 10,
+    "D": 30,
+    "E": 30,
+    "F": 5,
+    "G": 18,
+    "H": 20,
+    "I": 4,
+}
 
+# الهيدر
+OUTPUT_HEADER = [
+    "PackageId",
+    "Image",       # عمود معاينة الصورة
+    "ImagePath",   # اسم ملف الصورة (نصي فقط)
+    "Title - TRIM",
+    "PackageName",
+    "No",
+    "PartNo",
+    "Part Name And Standard",
+    "QTY",
+    "Category",
+    "delete",
+    "price",
+    "Description",
+    "Old Part No.",
+    "Names and specifications of old parts",
+    "note",
+    "is_red",
+    "is_line",
+    "is_deleted",
+    "is_orange",
+    "is_pink",
+    "is_yellow",
+    "internal_notes",
+]
+
+
+def iter_output_rows(all_rows: Iterable[tuple]):
+    """
+    ترجع أسطر ملف الإخراج بالترتيب (بعد الهيدر) كـ (row_idx, values, filename, image_bytes):
+    - row_idx رقم السطر في إكسل (1-based، الهيدر في الصف 1).
+    - values = None للسطر الفارغ الذي يفصل بين كل باكج والتي تليها.
+    نفس المنطق لكل محركات الكتابة، والمحرك يقرر فقط كيف يكتب السطر والصورة.
+    """
     # الهيدر في الصف 1، نبدأ العد من هناك
     row_idx = 1
-    last_pkg_key = None  # لتتبع تغيّر الباكج
+    last_uid = None  # لتتبع تغيّر الباكج
 
-    # البيانات + إدراج الصور مع سطر فارغ بين كل باكج والتي تليها
     for row_data in all_rows:
         (
             uid,
@@ -892,19 +1228,20 @@ def main():
             part_name_std,
             qty_val,
             category,
+            image_bytes,
         ) = row_data
 
-        # تعريف الباكج: uid + عنوان الملف + اسم الباكج
-        pkg_key = (uid, title_trim, pkg_name)
-
+        # تعريف الباكج: uid وحده يكفي (uuid4 جديد لكل باكج في كل ملف،
+        # فعنوان الملف واسم الباكج يتبعانه) بدل بناء tuple ومقارنته لكل سطر
         # لو تغيّرت الباكج عن السابقة → نضيف سطر فارغ
-        if last_pkg_key is not None and pkg_key != last_pkg_key:
+        if last_uid is not None and uid != last_uid:
             row_idx += 1
-            ws_out.append([""] * num_cols)  # سطر فارغ تماماً
+            yield row_idx, None, "", None
 
         # نضيف سطر الداتا لهذه الباكج
         row_idx += 1
-        ws_out.append([
+
+        yield row_idx, [
             uid,           # PackageId
             "",            # Image (الصورة فقط، لا نص)
             filename,      # ImagePath
@@ -928,25 +1265,240 @@ def main():
             "",            # is_pink
             "",            # is_yellow
             "",            # internal_notes
-        ])
+        ], filename, image_bytes
+
+        last_uid = uid
+
+
+def write_output_openpyxl(all_rows: Iterable[tuple], path: str) -> None:
+    """
+    تكتب ملف الإخراج بـ openpyxl في وضع write_only: الأسطر تُكتب مباشرة للملف
+    بدل الاحتفاظ بكل الخلايا في الذاكرة حتى save().
+    """
+    wb_out = Workbook(write_only=True)
+    ws_out = wb_out.create_sheet("packages")
+
+    for letter, width in OUTPUT_COLUMN_WIDTHS.items():
+        ws_out.column_dimensions[letter].width = width
+
+    ws_out.append(OUTPUT_HEADER)
+
+    # صورة واحدة محلّلة (PIL) لكل ملف؛ كل صف يأخذ نسخة منها بدل تحليل نفس البايتات من جديد
+    preview_cache: Dict[str, XLImage] = {}
+
+    # البيانات + إدراج الصور مع سطر فارغ بين كل باكج والتي تليها
+    for row_idx, values, filename, image_bytes in iter_output_rows(all_rows):
+        if values is None:
+            ws_out.append([])  # سطر فارغ تماماً (بدون إنشاء خلايا)
+            continue
+
+        # إدراج الصورة في العمود B لنفس الصف.
+        # في وضع write_only يجب ضبط ارتفاع السطر قبل كتابته، لذلك نضيف الصورة قبل append.
+        # نستخدم الصورة المصغّرة المحفوظة في الذاكرة بدل قراءة الملف الأصلي من الديسك مرة أخرى.
+        if filename and image_bytes:
+            try:
+                xl_img = make_row_image(preview_cache, filename, image_bytes)
+                xl_img.width = PREVIEW_SIZE[0]
+                xl_img.height = PREVIEW_SIZE[1]
+                ws_out.add_image(xl_img, f"B{row_idx}")
+                ws_out.row_dimensions[row_idx].height = 35
+            except Exception as e:
+                log_warn(f"Failed to embed image '{filename}' into Excel: {e}")
 
-        # إدراج الصورة في العمود B لنفس الصف
-        if filename:
-            img_path = os.path.join(IMAGES_DIR, filename)
-            if os.path.exists(img_path):
+        ws_out.append(values)
+
+    wb_out.save(path)
+
+
+def write_output_csv(all_rows: Iterable[tuple], path: str) -> None:
+    """
+    تكتب نفس أسطر ملف الإخراج (مع الأسطر الفارغة بين الباكجات) في ملف CSV.
+    عمود Image يبقى فارغاً، والصور موجودة في IMAGES_DIR باسمها في عمود ImagePath.
+    utf-8-sig حتى يتعرف إكسل على الترميز عند فتح الملف مباشرة.
+    """
+    with open(path, "w", newline="", encoding="utf-8-sig") as f:
+        writer = csv.writer(f)
+        writer.writerow(OUTPUT_HEADER)
+        for _row_idx, values, _filename, _image_bytes in iter_output_rows(all_rows):
+            writer.writerow(values if values is not None else ())
+
+
+def xlsxwriter_image_scale(
+    cache: Dict[str, Tuple[float, float]],
+    filename: str,
+    image_bytes: bytes,
+) -> Tuple[float, float]:
+    """
+    ترجع (x_scale, y_scale) لـ insert_image بحيث تظهر الصورة بمقاس PREVIEW_SIZE بالبكسل
+    (مثل width/height في openpyxl). xlsxwriter يحسب المقاس الأصلي من البكسلات و DPI
+    (DPI يُقرأ فقط من PNG و JPEG، وغير ذلك 96)، لذلك نحسب بنفس الطريقة.
+    التحليل بـ PIL مرة واحدة لكل filename.
+    """
+    scale = cache.get(filename)
+    if scale is None:
+        with PILImage.open(io.BytesIO(image_bytes)) as img:
+            width, height = img.size
+            dpi = img.info.get("dpi") if img.format in ("PNG", "JPEG") else None
+        x_dpi, y_dpi = dpi or (96, 96)
+        scale = (
+            PREVIEW_SIZE[0] * (x_dpi or 96) / (96 * width),
+            PREVIEW_SIZE[1] * (y_dpi or 96) / (96 * height),
+        )
+        cache[filename] = scale
+    return scale
+
+
+def write_output_xlsxwriter(all_rows: Iterable[tuple], path: str) -> None:
+    """
+    تكتب ملف الإخراج بـ xlsxwriter في وضع constant_memory (كل سطر يُكتب للديسك مباشرة).
+    xlsxwriter يتعرف على الصور المتطابقة (نفس البايتات) ويكتبها مرة واحدة في الملف،
+    بينما كل سطر يحتفظ بـ anchor خاص به في العمود B.
+    """
+    import xlsxwriter
+
+    wb_out = xlsxwriter.Workbook(path, {"constant_memory": True})
+    try:
+        ws_out = wb_out.add_worksheet("packages")
+
+        for letter, width in OUTPUT_COLUMN_WIDTHS.items():
+            ws_out.set_column(f"{letter}:{letter}", width)
+
+        ws_out.write_row(0, 0, OUTPUT_HEADER)
+
+        # مقياس كل صورة يُحسب مرة واحدة لكل filename
+        scale_cache: Dict[str, Tuple[float, float]] = {}
+
+        for row_idx, values, filename, image_bytes in iter_output_rows(all_rows):
+            if values is None:
+                continue  # السطر الفارغ لا يحتاج كتابة، row_idx يتقدم وحده
+
+            row = row_idx - 1  # xlsxwriter يعدّ الأسطر من 0
+
+            # في وضع constant_memory يجب ضبط ارتفاع السطر قبل كتابة خلاياه
+            if filename and image_bytes:
                 try:
-                    xl_img = XLImage(img_path)
-                    xl_img.width = 50
-                    xl_img.height = 50
-                    ws_out.add_image(xl_img, f"B{row_idx}")
-                    ws_out.row_dimensions[row_idx].height = 35
+                    x_scale, y_scale = xlsxwriter_image_scale(scale_cache, filename, image_bytes)
+                    ws_out.insert_image(
+                        row,
+                        1,
+                        filename,
+                        {
+                            "image_data": io.BytesIO(image_bytes),
+                            "x_scale": x_scale,
+                            "y_scale": y_scale,
+                        },
+                    )
+                    ws_out.set_row(row, 35)
                 except Exception as e:
-                    log_warn(f"Failed to embed image '{img_path}' into Excel: {e}")
+                    log_warn(f"Failed to embed image '{filename}' into Excel: {e}")
+
+            ws_out.write_row(row, 0, values)
+    finally:
+        wb_out.close()
+
+
+def write_output(all_rows: Iterable[tuple]) -> None:
+    """
+    تكتب ملف الإخراج (OUTPUT_EXCEL أو OUTPUT_CSV حسب OUTPUT_FORMAT) في ملف مؤقت بجانبه،
+    ثم تنقله مكان الملف النهائي بـ os.replace فقط بعد انتهاء كل الأسطر.
+    الأسطر تصل تدريجياً من الـ processes، فلو توقف التشغيل في المنتصف
+    لا يبقى ملف إخراج صالح الشكل لكن ناقص؛ الملف المؤقت يُحذف.
+    """
+    output_path = OUTPUT_CSV if OUTPUT_FORMAT == "csv" else OUTPUT_EXCEL
+    root, ext = os.path.splitext(output_path)
+    tmp_path = f"{root}.tmp{ext}"
+
+    try:
+        if OUTPUT_FORMAT == "csv":
+            write_output_csv(all_rows, tmp_path)
+        elif OUTPUT_ENGINE == "xlsxwriter":
+            write_output_xlsxwriter(all_rows, tmp_path)
+        else:
+            write_output_openpyxl(all_rows, tmp_path)
+    except BaseException:
+        # حتى مع Ctrl+C: لا نترك الملف المؤقت
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
 
-        last_pkg_key = pkg_key
+    os.replace(tmp_path, output_path)
 
-    wb_out.save(OUTPUT_EXCEL)
-    log_success(f"Data Excel file created: '{OUTPUT_EXCEL}'")
+
+# ==========================
+# الدالة الرئيسية
+# ==========================
+def find_xlsx_files(root_dir: str) -> List[str]:
+    """
+    تجمع مسارات ملفات .xlsx في root_dir وفي كل المجلدات الفرعية بنفس ترتيب os.walk
+    (ملفات المجلد أولاً ثم المجلدات الفرعية)، مع تجاهل ملفات إكسل المؤقتة (~$).
+    os.scandir يرجّع نوع كل entry من قراءة المجلد نفسها بدون stat إضافي.
+    """
+    xlsx_files: List[str] = []
+    subdirs: List[str] = []
+    try:
+        with os.scandir(root_dir) as entries:
+            for entry in entries:
+                if entry.is_dir(follow_symlinks=False):
+                    subdirs.append(entry.path)
+                    continue
+                name = entry.name
+                if name.lower().endswith(".xlsx") and not name.startswith("~$"):
+                    xlsx_files.append(entry.path)
+    except OSError:
+        return xlsx_files
+
+    for subdir in subdirs:
+        xlsx_files.extend(find_xlsx_files(subdir))
+    return xlsx_files
+
+
+def main():
+    """
+    - يحضّر فولدر الصور.
+    - يعالج كل ملف .xlsx في ROOT_DIR وفي المجلدات الفرعية داخله.
+    - يبني ملف إكسل جديد packages_data.xlsx (أو packages_data.csv حسب OUTPUT_FORMAT)
+      يحتوي أسطر القطع مع تكرار بيانات الباكج لكل سطر.
+    - يضع الصورة في عمود مستقل (B) واسم الملف في عمود مستقل (C).
+    - يترك سطرًا فارغًا بعد أسطر كل باكج قبل بدء الباكج التالية.
+    """
+    ensure_clean_images_dir()
+
+    # نجمع كل ملفات .xlsx في ROOT_DIR وفي كل المجلدات الفرعية
+    xlsx_files = find_xlsx_files(ROOT_DIR)
+
+    if not xlsx_files:
+        log_error(f"No .xlsx files found under ROOT_DIR: {ROOT_DIR}")
+        return
+
+    log_info(f"Found {len(xlsx_files)} .xlsx file(s) under ROOT_DIR: {ROOT_DIR}")
+    if DEBUG_ENABLED:
+        for path in xlsx_files:
+            rel = os.path.relpath(path, ROOT_DIR)
+            log_debug(f"- {rel}")
+
+    # معالجة كل ملف إكسل وكتابة أسطره في ملف الإخراج.
+    # الملفات مستقلة عن بعضها فنعالجها بالتوازي على عدة processes؛
+    # أسماء الصور UUID فلا يوجد تعارض عند الكتابة في نفس IMAGES_DIR.
+    # executor.map يرجّع النتائج بنفس ترتيب الملفات (اللوغ فقط قد يتداخل)،
+    # والكتابة تبدأ مع نتيجة أول ملف بينما الباقي ما زال يُعالج،
+    # بدل تجميع كل الأسطر في قائمة واحدة قبل الكتابة.
+    max_workers = min(len(xlsx_files), os.cpu_count() or 1)
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+        all_rows = chain.from_iterable(executor.map(process_file, xlsx_files))
+
+        # نتأكد أن هناك سطراً واحداً على الأقل قبل إنشاء ملف الإخراج
+        first_row = next(all_rows, None)
+        if first_row is None:
+            log_warn("No rows were collected. Excel data file will not be created.")
+            return
+        all_rows = chain((first_row,), all_rows)
+
+        write_output(all_rows)
+
+    if OUTPUT_FORMAT == "csv":
+        log_success(f"Data CSV file created: '{OUTPUT_CSV}'")
+    else:
+        log_success(f"Data Excel file created: '{OUTPUT_EXCEL}'")
 
 if __name__ == "__main__":
     main()
@@ -1,6 +1,7 @@
 import os
 from typing import List, Dict, Optional
 
+import pywintypes
 import win32com.client as win32
 
 # ==========================
@@ -14,6 +15,9 @@ IMAGES_DIR = os.path.join(SCRIPT_DIR, "images")
 # msoShapeType constants (we mainly care about pictures)
 MSO_PICTURE = 13  # from Office constants
 
+# XlCalculation: the workbooks are only read, so no recalculation is needed
+XL_CALCULATION_MANUAL = -4135
+
 
 # ==========================
 # Helpers
@@ -24,8 +28,8 @@ def ensure_dir(path: str) -> None:
         os.makedirs(path, exist_ok=True)
 
 
-def is_excel_file(path: str) -> bool:
-    name = os.path.basename(path)
+def is_excel_file(name: str) -> bool:
+    """`name` is a bare file name (as yielded by os.walk), not a full path."""
     if name.startswith("~$"):
         return False
     return name.lower().endswith(".xlsx")
@@ -94,6 +98,59 @@ def export_shape_to_image(shp, global_index: int) -> str:
     return full_path
 
 
+def snapshot_pictures(shapes) -> List[Dict]:
+    """
+    Enumerate the sheet's Shapes once and read the properties of every picture.
+
+    Returns list of dicts:
+    [
+      {"shape": <COM shape>, "type": 13, "name": ..., "left": ..., "top": ...,
+       "width": ..., "height": ..., "row_start": ..., "row_end": ..., "row_error": None},
+      ...
+    ]
+    """
+    pictures: List[Dict] = []
+
+    for i, shp in enumerate(shapes, start=1):
+        try:
+            shp_type = shp.Type
+        except Exception:
+            shp_type = None
+
+        # We care about pictures; you can loosen this if needed
+        if shp_type != MSO_PICTURE:
+            continue
+
+        try:
+            info = {
+                "shape": shp,
+                "type": shp_type,
+                "name": shp.Name,
+                "left": float(shp.Left),
+                "top": float(shp.Top),
+                "width": float(shp.Width),
+                "height": float(shp.Height),
+                "row_start": None,
+                "row_end": None,
+                "row_error": None,
+            }
+        except Exception as e:
+            print(f"  [SHAPE #{i}] ERROR: cannot read shape properties: {e}")
+            continue
+
+        # Get row_start / row_end from Excel via TopLeftCell / BottomRightCell
+        try:
+            info["row_start"] = int(shp.TopLeftCell.Row)
+            info["row_end"] = int(shp.BottomRightCell.Row)
+        except Exception as e:
+            info["row_start"] = info["row_end"] = None
+            info["row_error"] = e
+
+        pictures.append(info)
+
+    return pictures
+
+
 # ==========================
 # Process one workbook
 # ==========================
@@ -110,6 +167,16 @@ def process_workbook(excel_app, path: str, global_index_start: int) -> int:
     wb = excel_app.Workbooks.Open(path, ReadOnly=True)
     current_index = global_index_start
 
+    # Application-level setting, but Excel only accepts it while a workbook is open.
+    # Dispatch may attach to the user's running Excel, so remember the current mode
+    # and put it back before closing the workbook.
+    original_calculation = None
+    try:
+        original_calculation = excel_app.Calculation
+        excel_app.Calculation = XL_CALCULATION_MANUAL
+    except pywintypes.com_error as e:
+        print(f"[WARN]  Could not switch calculation to manual: {e}")
+
     try:
         for ws in wb.Worksheets:
             sheet_name = ws.Name
@@ -128,43 +195,36 @@ def process_workbook(excel_app, path: str, global_index_start: int) -> int:
                 print("[INFO]   No shapes in this sheet.")
                 continue
 
+            # Pass 1: one enumeration over the Shapes collection, copying the properties
+            # we need into plain Python dicts before any shape is exported
+            pictures = snapshot_pictures(shapes)
+            if not pictures:
+                continue
+
             # Build row boundaries once for this sheet (for center-based rows)
             row_boundaries = build_row_boundaries_excel(ws)
 
-            for i in range(1, shapes_count + 1):
-                try:
-                    shp = shapes.Item(i)
-                except Exception as e:
-                    print(f"  [SHAPE #{i}] ERROR: cannot get shape: {e}")
-                    continue
-
-                try:
-                    shp_type = shp.Type
-                except Exception:
-                    shp_type = None
-
-                # We care about pictures; you can loosen this if needed
-                if shp_type != MSO_PICTURE:
-                    continue
-
+            # Pass 2: row resolution + export, working on the snapshot
+            for info in pictures:
                 current_index += 1  # assign a unique global index
 
-                name = shp.Name
-                left = float(shp.Left)
-                top = float(shp.Top)
-                width = float(shp.Width)
-                height = float(shp.Height)
+                shp = info["shape"]
+                shp_type = info["type"]
+                name = info["name"]
+                left = info["left"]
+                top = info["top"]
+                width = info["width"]
+                height = info["height"]
                 center_y = top + height / 2.0
 
-                # Get row_start / row_end from Excel via TopLeftCell / BottomRightCell
-                row_start = row_end = anchor_row = None
-                try:
-                    top_left_cell = shp.TopLeftCell
-                    bottom_right_cell = shp.BottomRightCell
-                    row_start = int(top_left_cell.Row)
-                    row_end = int(bottom_right_cell.Row)
-                except Exception as e:
-                    print(f"  [IMAGE #{current_index}] WARNING: cannot get TopLeftCell/BottomRightCell: {e}")
+                row_start = info["row_start"]
+                row_end = info["row_end"]
+                anchor_row = None
+                if info["row_error"] is not None:
+                    print(
+                        f"  [IMAGE #{current_index}] WARNING: cannot get TopLeftCell/BottomRightCell: "
+                        f"{info['row_error']}"
+                    )
 
                 # Decide final anchor_row
                 if row_start is not None and row_end is not None:
@@ -208,6 +268,11 @@ def process_workbook(excel_app, path: str, global_index_start: int) -> int:
                 print("")
 
     finally:
+        if original_calculation is not None:
+            try:
+                excel_app.Calculation = original_calculation
+            except pywintypes.com_error as e:
+                print(f"[WARN]  Could not restore calculation mode: {e}")
         wb.Close(SaveChanges=False)
 
     return current_index
@@ -228,9 +293,9 @@ def walk_and_process_root(root_dir: str) -> None:
     try:
         for dirpath, dirnames, filenames in os.walk(root_dir):
             for filename in filenames:
-                full_path = os.path.join(dirpath, filename)
-                if not is_excel_file(full_path):
+                if not is_excel_file(filename):
                     continue
+                full_path = os.path.join(dirpath, filename)
 
                 try:
                     global_index = process_workbook(excel_app, full_path, global_index)
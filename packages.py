@@ -1,8 +1,18 @@
+import csv
+import importlib.util
 import os
-from uuid import uuid4
-from typing import List, Dict, Any, Tuple, Optional
+import re
+import shelve
+from bisect import bisect_right
+from concurrent.futures import ProcessPoolExecutor
+from itertools import accumulate, chain
+from uuid import UUID
+from typing import List, Dict, Any, Iterable, Iterator, Tuple, Optional
 
-from openpyxl import load_workbook, Workbook
+from openpyxl import Workbook
+
+# قراءة الشيت (مشتركة مع extract_images_all.py)
+from sheet_reader import read_sheet_data
 
 # ==========================
 # إعدادات عامة
@@ -15,11 +25,27 @@ ROOT_DIR = os.path.join(SCRIPT_DIR, "TurnKeyFiles2")
 # اسم ملف الداتا الناتج (بجانب السكربت أيضاً)
 OUTPUT_EXCEL = os.path.join(SCRIPT_DIR, "packages_data.xlsx")
 
+# صيغة ملف الإخراج: "xlsx" أو "csv" (أسرع بكثير للكميات الكبيرة: بدون XML ولا zip)
+OUTPUT_FORMAT = "xlsx"
+OUTPUT_CSV = os.path.join(SCRIPT_DIR, "packages_data.csv")
+
+# xlsxwriter أسرع من openpyxl في كتابة الملف الناتج (حتى مع write_only)؛ نستخدمه إن كان مثبتاً
+OUTPUT_ENGINE = "xlsxwriter" if importlib.util.find_spec("xlsxwriter") else "openpyxl"
+
+# كاش لنتائج كل ملف بين التشغيلات (مفتاحه المسار + وقت التعديل + الحجم):
+# الملف الذي لم يتغيّر لا يُفتح من جديد. مفيد عند إعادة التشغيل على نفس الملفات أثناء التطوير.
+USE_RESULT_CACHE = False
+RESULT_CACHE_FILE = os.path.join(SCRIPT_DIR, ".packages_cache")
+# غيّر الرقم عند تعديل منطق الاستخراج حتى لا تُستخدم نتائج محفوظة بالمنطق القديم
+RESULT_CACHE_VERSION = "1"
+
 # كلمات الهيدر التي نبحث عنها (تُقارن بحروف صغيرة)
 HEADER_KEYWORDS = ("part number", "description", "qty")
+# نفس الكلمات كـ regex واحد مُجمّع مسبقاً (بحث واحد بدل any(...) على كل كلمة)
+HEADER_RE = re.compile("|".join(re.escape(keyword) for keyword in HEADER_KEYWORDS))
 
 # قيم إكسل الخطأ التي لا يجب اعتبارها أسماء باكجات
-EXCLUDED_PACKAGE_TOKENS = {
+EXCLUDED_PACKAGE_TOKENS = frozenset({
     "#unknown!",
     "#value!",
     "#div/0!",
@@ -28,7 +54,10 @@ EXCLUDED_PACKAGE_TOKENS = {
     "#null!",
     "#num!",
     "#n/a",
-}
+})
+
+# أشكال عنوان عمود رقم السطر (بعد strip + lower)، إضافة إلى "#"
+NO_HEADER_TOKENS = frozenset({"no", "no.", "no#", "no:"})
 
 # أكواد ألوان ANSI للّوغ (بدون مكتبات إضافية)
 RESET = "\033[0m"
@@ -39,24 +68,47 @@ RED = "\033[31m"
 MAGENTA = "\033[35m"
 
 
+# مستويات اللوغ: الرسائل الأقل من LOG_LEVEL لا تُطبع.
+# رسائل DEBUG تُكتب لكل باكج/دمج، لذلك نخفيها افتراضياً؛
+# اجعل LOG_LEVEL هو LOG_DEBUG لرؤية التفاصيل.
+LOG_DEBUG = 10
+LOG_INFO = 20
+LOG_WARN = 30
+LOG_ERROR = 40
+# يمكن تغييره بدون تعديل الكود: LOG_LEVEL=DEBUG (أو INFO / WARN / ERROR)
+LOG_LEVEL = {
+    "DEBUG": LOG_DEBUG,
+    "INFO": LOG_INFO,
+    "WARN": LOG_WARN,
+    "ERROR": LOG_ERROR,
+}.get(os.environ.get("LOG_LEVEL", "").strip().upper(), LOG_INFO)
+# نستخدمه في الحلقات قبل بناء نص الرسالة (f-string) حتى لا ندفع ثمنه بلا فائدة
+DEBUG_ENABLED = LOG_LEVEL <= LOG_DEBUG
+
+
 def log_info(msg: str) -> None:
-    print(f"{CYAN}[INFO]{RESET} {msg}")
+    if LOG_LEVEL <= LOG_INFO:
+        print(f"{CYAN}[INFO]{RESET} {msg}")
 
 
 def log_warn(msg: str) -> None:
-    print(f"{YELLOW}[WARN]{RESET} {msg}")
+    if LOG_LEVEL <= LOG_WARN:
+        print(f"{YELLOW}[WARN]{RESET} {msg}")
 
 
 def log_success(msg: str) -> None:
-    print(f"{GREEN}[OK]{RESET}   {msg}")
+    if LOG_LEVEL <= LOG_INFO:
+        print(f"{GREEN}[OK]{RESET}   {msg}")
 
 
 def log_error(msg: str) -> None:
-    print(f"{RED}[ERROR]{RESET} {msg}")
+    if LOG_LEVEL <= LOG_ERROR:
+        print(f"{RED}[ERROR]{RESET} {msg}")
 
 
 def log_debug(msg: str) -> None:
-    print(f"{MAGENTA}[DEBUG]{RESET} {msg}")
+    if LOG_LEVEL <= LOG_DEBUG:
+        print(f"{MAGENTA}[DEBUG]{RESET} {msg}")
 
 
 # ==========================
@@ -69,7 +121,14 @@ def to_int_or_none(value) -> Optional[int]:
     """
     if value is None:
         return None
+    # المسار السريع: الأرقام كما يرجعها openpyxl لا تحتاج str/strip/float
+    # (bool ليس رقماً هنا: str(True) لا يتحول إلى float فيرجع None كما كان)
+    value_type = type(value)
+    if value_type is int:
+        return value
     try:
+        if value_type is float:
+            return int(value)
         text = str(value).strip()
         if not text:
             return None
@@ -79,31 +138,40 @@ def to_int_or_none(value) -> Optional[int]:
         return None
 
 
+def new_uids(count: int) -> List[str]:
+    """
+    تولّد count من معرّفات UUID4 كنصوص.
+    نقرأ البايتات العشوائية دفعة واحدة (os.urandom واحد) بدل uuid4() لكل باكج؛
+    version=4 تضبط بتات النسخة والـ variant حسب RFC 4122.
+    """
+    raw = os.urandom(16 * count)
+    return [str(UUID(bytes=raw[i:i + 16], version=4)) for i in range(0, 16 * count, 16)]
+
+
 # ==========================
 # حساب إحداثيات Y للصفوف (نحتفظ به لو احتجناه لاحقاً)
 # ==========================
 
-def compute_row_y_map(ws):
+def compute_row_y_map(row_heights: Dict[int, float], default_height_points: float, max_row: int):
     """
     تحسب إحداثيات Y (بالـ EMU) لكل صف:
     top_y[row] = بداية الصف
     bottom_y[row] = نهاية الصف
     """
-    sheet_format = ws.sheet_format
-    default_height_points = sheet_format.defaultRowHeight or 15  # نقاط
     EMU_PER_POINT = 12700
 
-    top_y = {}
-    bottom_y = {}
-    acc = 0
+    # الديفولت لكل الصفوف، ثم فقط الصفوف ذات الارتفاع المخصص
+    heights = [default_height_points * EMU_PER_POINT] * (max_row + 1)
+    for r, height in row_heights.items():
+        if 1 <= r <= max_row:
+            heights[r] = height * EMU_PER_POINT
+
+    # edges[r] = نهاية الصف r = بداية الصف r + 1
+    edges = list(accumulate(heights[1:], initial=0))
 
-    for r in range(1, ws.max_row + 1):
-        h = ws.row_dimensions[r].height
-        if h is None:
-            h = default_height_points
-        top_y[r] = acc
-        acc += h * EMU_PER_POINT
-        bottom_y[r] = acc
+    # قوائم مفهرسة برقم الصف (1-based)، العنصر 0 غير مستخدم
+    top_y = [0] + edges[:-1]
+    bottom_y = edges
 
     log_info(
         f"Row Y mapping computed using default height {default_height_points} pt "
@@ -116,21 +184,20 @@ def compute_row_y_map(ws):
 # منطق استخراج الباكجات
 # ==========================
 
-def find_first_header_row(ws) -> int:
+def find_first_header_row(grid: List[list]) -> int:
     """
     تبحث عن أول سطر يحتوي على أي من الكلمات:
     Part Number / Description / Qty
     في أي عمود من الأعمدة، وترجع رقم السطر (1-based).
     لو لم تجده ترجع 0.
     """
-    for row in range(1, ws.max_row + 1):
-        for col in range(1, ws.max_column + 1):
-            cell_value = ws.cell(row=row, column=col).value
-            if not cell_value:
+    for row, values in enumerate(grid, start=1):
+        for col, cell_value in enumerate(values, start=1):
+            # كلمات الهيدر نصوص فقط، و strip لا يغيّر نتيجة البحث داخل النص
+            if not cell_value or not isinstance(cell_value, str):
                 continue
 
-            text = str(cell_value).strip().lower()
-            if any(keyword in text for keyword in HEADER_KEYWORDS):
+            if HEADER_RE.search(cell_value.lower()):
                 log_info(
                     f"First header row detected at row {row} "
                     f"(col {col}) with value '{cell_value}'"
@@ -141,11 +208,11 @@ def find_first_header_row(ws) -> int:
     return 0
 
 
-def build_packages(ws, top_y, bottom_y) -> List[Dict[str, Any]]:
+def build_packages(grid: List[list], top_y, bottom_y) -> List[Dict[str, Any]]:
     """
     تبني قائمة الباكجات اعتماداً على العمود الأول.
     """
-    header_row = find_first_header_row(ws)
+    header_row = find_first_header_row(grid)
     if header_row <= 1:
         log_error("Cannot determine package start row (header row not found or at first row).")
         return []
@@ -156,19 +223,22 @@ def build_packages(ws, top_y, bottom_y) -> List[Dict[str, Any]]:
     packages: List[Dict[str, Any]] = []
     current_package: Optional[Dict[str, Any]] = None
 
-    for row in range(start_row, ws.max_row + 1):
-        cell_value = ws.cell(row=row, column=1).value
+    max_row = len(grid)
+
+    for row, values in enumerate(grid[start_row - 1:], start=start_row):
+        cell_value = values[0]
         if cell_value is None:
             continue
 
         text = str(cell_value).strip()
         lower_text = text.lower()
 
-        if any(keyword in lower_text for keyword in HEADER_KEYWORDS):
+        if HEADER_RE.search(lower_text):
             continue
 
         if lower_text in EXCLUDED_PACKAGE_TOKENS:
-            log_debug(f"Ignoring error-like value at row {row}: '{text}'")
+            if DEBUG_ENABLED:
+                log_debug(f"Ignoring error-like value at row {row}: '{text}'")
             continue
 
         if current_package is not None:
@@ -178,7 +248,7 @@ def build_packages(ws, top_y, bottom_y) -> List[Dict[str, Any]]:
             packages.append(current_package)
 
         current_package = {
-            "uid": str(uuid4()),
+            "uid": None,
             "name": text,
             "start_row": row,
             "end_row": None,
@@ -188,7 +258,7 @@ def build_packages(ws, top_y, bottom_y) -> List[Dict[str, Any]]:
         }
 
     if current_package is not None:
-        current_package["end_row"] = ws.max_row
+        current_package["end_row"] = max_row
         current_package["y_start"] = top_y[current_package["start_row"]]
         current_package["y_end"] = bottom_y[current_package["end_row"]]
         packages.append(current_package)
@@ -197,11 +267,15 @@ def build_packages(ws, top_y, bottom_y) -> List[Dict[str, Any]]:
         log_warn("No packages were detected.")
         return []
 
+    # معرّفات كل الباكجات دفعة واحدة بعد معرفة عددها
+    for pkg, uid in zip(packages, new_uids(len(packages))):
+        pkg["uid"] = uid
+
     log_success(f"{len(packages)} packages detected.")
     return packages
 
 
-def fill_packages_categories(ws, packages: List[Dict[str, Any]]) -> None:
+def fill_packages_categories(grid: List[list], packages: List[Dict[str, Any]]) -> None:
     """
     ملء Category من العمود F ضمن مدى أسطر كل باكج.
     """
@@ -210,8 +284,8 @@ def fill_packages_categories(ws, packages: List[Dict[str, Any]]) -> None:
     for pkg in packages:
         category = None
 
-        for row in range(pkg["start_row"], pkg["end_row"] + 1):
-            cell_value = ws.cell(row=row, column=CATEGORY_COL).value
+        for values in grid[pkg["start_row"] - 1:pkg["end_row"]]:
+            cell_value = values[CATEGORY_COL - 1]
             if isinstance(cell_value, str):
                 text = cell_value.strip()
                 if text:
@@ -219,17 +293,18 @@ def fill_packages_categories(ws, packages: List[Dict[str, Any]]) -> None:
                     break
 
         pkg["category"] = category
-        log_debug(
-            f"Package '{pkg['name']}' rows [{pkg['start_row']}-{pkg['end_row']}]: "
-            f"Category = '{category}'"
-        )
+        if DEBUG_ENABLED:
+            log_debug(
+                f"Package '{pkg['name']}' rows [{pkg['start_row']}-{pkg['end_row']}]: "
+                f"Category = '{category}'"
+            )
 
 
 # ==========================
 # اكتشاف أعمدة No / PartNo / Desc / QTY
 # ==========================
 
-def detect_detail_columns(ws, first_package: Dict[str, Any]) -> Optional[Tuple[int, int, int, int]]:
+def detect_detail_columns(grid: List[list], first_package: Dict[str, Any]) -> Optional[Tuple[int, int, int, int]]:
     """
     نبحث عن عمود رقم السطر (No) بهذه الأولوية:
     1) عمود عنوانه بالضبط "#"
@@ -244,42 +319,42 @@ def detect_detail_columns(ws, first_package: Dict[str, Any]) -> Optional[Tuple[i
     MAX_OFFSET_COLS = 5
     last_col_to_check = FIRST_DATA_COL + MAX_OFFSET_COLS - 1
 
-    candidate_no_cols = []
+    max_column = len(grid[0]) if grid else 0
+
+    found: Optional[Tuple[int, int, str]] = None
 
-    for row in range(start_row, end_row + 1):
-        for col in range(FIRST_DATA_COL, last_col_to_check + 1):
-            cell_value = ws.cell(row=row, column=col).value
+    for row, values in enumerate(grid[start_row - 1:end_row], start=start_row):
+        window = values[FIRST_DATA_COL - 1:last_col_to_check]
+        for col, cell_value in enumerate(window, start=FIRST_DATA_COL):
             if not isinstance(cell_value, str):
                 continue
 
             raw = cell_value.strip()
-            lower = raw.lower()
-
-            is_hash = (raw == "#")
-            is_no = (lower in {"no", "no.", "no#", "no:"})
-
-            if not (is_hash or is_no):
-                continue
 
-            candidate_no_cols.append((row, col, raw))
+            if raw == "#" or raw.lower() in NO_HEADER_TOKENS:
+                # نكتفي بأول تطابق (أقرب شيء للأعلى) ونوقف المسح مباشرة
+                found = (row, col, raw)
+                break
+        if found is not None:
+            break
 
-    if not candidate_no_cols:
+    if found is None:
         log_warn(
             "Could not detect detail columns (No / Part Number / Description / QTY) "
             "inside the first package range."
         )
         return None
 
-    row, col_no, header_text = candidate_no_cols[0]
+    row, col_no, header_text = found
 
     col_part = col_no + 1
     col_desc = col_no + 2
     col_qty = col_no + 3
 
-    if col_qty > ws.max_column:
+    if col_qty > max_column:
         log_warn(
             f"Detected No-like header '{header_text}' at col {col_no} row {row} "
-            f"but following columns exceed max_column={ws.max_column}."
+            f"but following columns exceed max_column={max_column}."
         )
         return None
 
@@ -294,108 +369,107 @@ def detect_detail_columns(ws, first_package: Dict[str, Any]) -> Optional[Tuple[i
 # فك الدمج العمودي (forward-fill) في أعمدة التفاصيل
 # ==========================
 
-def flatten_vertical_merges_in_column(ws, col: int) -> None:
+def index_vertical_merges_by_column(merged_ranges) -> Dict[int, List[Tuple[int, int]]]:
     """
-    يفك الدمج العمودي في عمود واحد (مثل عمود No أو QTY)
+    مرور واحد على نطاقات الدمج: {col: [(min_row, max_row), ...]}
+    فقط للدمج العمودي داخل عمود واحد.
     """
-    merged_ranges = list(ws.merged_cells.ranges)
-
+    by_col: Dict[int, List[Tuple[int, int]]] = {}
     for merged_range in merged_ranges:
-        min_row = merged_range.min_row
-        max_row = merged_range.max_row
         min_col = merged_range.min_col
-        max_col = merged_range.max_col
+        if min_col == merged_range.max_col and merged_range.max_row > merged_range.min_row:
+            by_col.setdefault(min_col, []).append((merged_range.min_row, merged_range.max_row))
+    return by_col
 
-        if min_col == max_col == col and max_row > min_row:
-            value = ws.cell(row=min_row, column=col).value
-            ws.unmerge_cells(str(merged_range))
 
-            if value is not None and str(value).strip() != "":
-                for row in range(min_row, max_row + 1):
-                    ws.cell(row=row, column=col).value = value
+def flatten_vertical_merges_in_column(
+    grid: List[list],
+    col: int,
+    merges_by_col: Dict[int, List[Tuple[int, int]]],
+) -> None:
+    """
+    يفك الدمج العمودي في عمود واحد (مثل عمود No أو QTY) داخل الـ grid.
+    الشيت الأصلي لا يُحفظ، لذلك لا نحتاج unmerge في openpyxl نفسه.
+    """
+    for min_row, max_row in merges_by_col.get(col, ()):
+        value = grid[min_row - 1][col - 1]
 
+        if value is not None and str(value).strip() != "":
+            for row in range(min_row, max_row + 1):
+                grid[row - 1][col - 1] = value
+
+        if DEBUG_ENABLED:
             log_debug(
                 f"Flattened vertical merge in col {col} "
                 f"rows [{min_row}-{max_row}] with value '{value}'"
             )
 
 
-def forward_fill_column_in_range(ws, col: int, start_row: int, end_row: int) -> None:
-    last_value = None
-
-    for row in range(start_row, end_row + 1):
-        cell = ws.cell(row=row, column=col)
-        value = cell.value
-
-        if value is not None and str(value).strip() != "":
-            last_value = value
+def column_texts(grid: List[list], col: int) -> List[str]:
+    """
+    نص كل خلية في العمود بعد str + strip ("" للخلية الفارغة)، بنفس ترتيب أسطر الـ grid.
+    يُحسب مرة واحدة لعمودي Part و Desc ويُستخدم في تحديد أسطر الداتا وفي بناء الأسطر.
+    """
+    c = col - 1
+    texts = []
+    for values in grid:
+        value = values[c]
+        if value is None:
+            texts.append("")
+        elif isinstance(value, str):
+            texts.append(value.strip())
         else:
-            if last_value is not None:
-                cell.value = last_value
+            texts.append(str(value).strip())
+    return texts
 
 
-def find_data_rows_range_for_package(
-    ws,
-    pkg: Dict[str, Any],
-    col_part: int,
-    col_desc: int,
-) -> Optional[Tuple[int, int]]:
+def compute_all_data_ranges(
+    part_texts: List[str],
+    desc_texts: List[str],
+    packages: List[Dict[str, Any]],
+) -> Dict[int, Tuple[int, int]]:
     """
-    يحدد نطاق أسطر البيانات (parts) لكل باكج.
+    يحدد نطاق أسطر البيانات (parts) لكل الباكجات في مرور واحد على الأسطر،
+    ويحدد باكج كل سطر بـ bisect على start_row.
+    يرجع {package_index: (data_start, data_end)}؛ الباكج بدون داتا لا تظهر فيه.
     """
-    data_start = None
-    data_end = None
+    starts = [pkg["start_row"] for pkg in packages]
+    ranges: Dict[int, List[int]] = {}
 
-    for row in range(pkg["start_row"], pkg["end_row"] + 1):
-        part_val = ws.cell(row=row, column=col_part).value
-        desc_val = ws.cell(row=row, column=col_desc).value
+    for row in range(packages[0]["start_row"], packages[-1]["end_row"] + 1):
+        if part_texts[row - 1] or desc_texts[row - 1]:
+            idx = bisect_right(starts, row) - 1
+            rng = ranges.get(idx)
+            if rng is None:
+                ranges[idx] = [row, row]
+            else:
+                rng[1] = row
 
-        has_part = part_val is not None and str(part_val).strip() != ""
-        has_desc = desc_val is not None and str(desc_val).strip() != ""
-
-        if has_part or has_desc:
-            if data_start is None:
-                data_start = row
-            data_end = row
-
-    if data_start is None or data_end is None:
-        return None
-
-    return data_start, data_end
+    return {idx: (data_start, data_end) for idx, (data_start, data_end) in ranges.items()}
 
 
 def normalize_merged_detail_cells_for_all_packages(
-    ws,
+    grid: List[list],
+    merged_ranges,
     packages: List[Dict[str, Any]],
     col_no: int,
-    col_part: int,
-    col_desc: int,
+    part_texts: List[str],
+    desc_texts: List[str],
     col_qty: int,
 ) -> Dict[int, Tuple[int, int]]:
     """
-    تعوّض الدمج العمودي داخل أعمدة تفاصيل القطع ضمن مجال أسطر الداتا لكل باكج.
+    تعوّض الدمج العمودي داخل أعمدة تفاصيل القطع (No و QTY) في الـ grid،
+    وتحدد مجال أسطر الداتا لكل باكج. الـ forward-fill يتم لاحقاً أثناء بناء الأسطر.
     """
-    flatten_vertical_merges_in_column(ws, col_no)
-    flatten_vertical_merges_in_column(ws, col_qty)
+    merges_by_col = index_vertical_merges_by_column(merged_ranges)
+    flatten_vertical_merges_in_column(grid, col_no, merges_by_col)
+    flatten_vertical_merges_in_column(grid, col_qty, merges_by_col)
 
-    data_ranges: Dict[int, Tuple[int, int]] = {}
+    data_ranges = compute_all_data_ranges(part_texts, desc_texts, packages)
 
     for idx, pkg in enumerate(packages):
-        res = find_data_rows_range_for_package(ws, pkg, col_part, col_desc)
-        if res is None:
+        if idx not in data_ranges:
             log_warn(f"No data rows found for package '{pkg['name']}'.")
-            continue
-
-        data_start, data_end = res
-        data_ranges[idx] = (data_start, data_end)
-
-        forward_fill_column_in_range(ws, col_no, data_start, data_end)
-        forward_fill_column_in_range(ws, col_qty, data_start, data_end)
-
-        log_debug(
-            f"Forward-filled No/QTY for package '{pkg['name']}' "
-            f"rows [{data_start}-{data_end}]."
-        )
 
     return data_ranges
 
@@ -417,24 +491,24 @@ def process_workbook(path: str) -> List[tuple]:
 
     log_info(f"Opening workbook: {basename}")
 
+    # القيم والدمج وارتفاعات الصفوف نقرؤها في مرور واحد إلى grid (بدون كائنات Cell)،
+    # وكل التوابع بعدها تعمل عليه بدل ws.cell()
     try:
-        wb = load_workbook(path, data_only=True)
+        grid, merged_ranges, row_heights, default_height = read_sheet_data(path, log_warn)
     except Exception as e:
         log_error(f"Failed to open '{basename}': {e}")
         return []
 
-    ws = wb.active
+    top_y, bottom_y = compute_row_y_map(row_heights, default_height, len(grid))
 
-    top_y, bottom_y = compute_row_y_map(ws)
-
-    packages = build_packages(ws, top_y, bottom_y)
+    packages = build_packages(grid, top_y, bottom_y)
     if not packages:
         log_warn(f"No packages found in '{basename}'.")
         return []
 
-    fill_packages_categories(ws, packages)
+    fill_packages_categories(grid, packages)
 
-    detail_cols = detect_detail_columns(ws, packages[0])
+    detail_cols = detect_detail_columns(grid, packages[0])
     rows_for_excel: List[tuple] = []
 
     if detail_cols is None:
@@ -454,15 +528,27 @@ def process_workbook(path: str) -> List[tuple]:
 
     col_no, col_part, col_desc, col_qty = detail_cols
 
+    # نص Part و Desc منظّف مرة واحدة (لا يتغيران بفك الدمج أو الـ forward-fill)
+    part_texts = column_texts(grid, col_part)
+    desc_texts = column_texts(grid, col_desc)
+
     data_ranges_by_pkg_index = normalize_merged_detail_cells_for_all_packages(
-        ws,
+        grid,
+        merged_ranges,
         packages,
         col_no,
-        col_part,
-        col_desc,
+        part_texts,
+        desc_texts,
         col_qty,
     )
 
+    c_no = col_no - 1
+    c_qty = col_qty - 1
+
+    # أسماء محلية لما يُستدعى في كل سطر (بدل البحث في globals وعن append في كل مرة)
+    to_int = to_int_or_none
+    append_row = rows_for_excel.append
+
     # نمر على كل باكج ونبني أسطر القطع
     for idx, pkg in enumerate(packages):
         if idx not in data_ranges_by_pkg_index:
@@ -475,27 +561,40 @@ def process_workbook(path: str) -> List[tuple]:
         pkg_name = pkg["name"]
         category = pkg.get("category") or ""
 
+        # forward-fill لعمودي No و QTY ضمن مجال الداتا في نفس مرور بناء الأسطر:
+        # الخلية الفارغة (None أو نص فارغ بعد strip) تأخذ آخر قيمة غير فارغة فوقها
+        last_no = None
+        last_qty = None
+
         for row in range(data_start, data_end + 1):
-            no_val = ws.cell(row=row, column=col_no).value
-            part_val = ws.cell(row=row, column=col_part).value
-            desc_val = ws.cell(row=row, column=col_desc).value
-            qty_val = ws.cell(row=row, column=col_qty).value
-
-            has_part = part_val is not None and str(part_val).strip() != ""
-            has_desc = desc_val is not None and str(desc_val).strip() != ""
-            if not (has_part or has_desc):
+            values = grid[row - 1]
+
+            no_val = values[c_no]
+            if no_val is None or (isinstance(no_val, str) and not no_val.strip()):
+                no_val = last_no
+            else:
+                last_no = no_val
+
+            qty_val = values[c_qty]
+            if qty_val is None or (isinstance(qty_val, str) and not qty_val.strip()):
+                qty_val = last_qty
+            else:
+                last_qty = qty_val
+
+            part_str = part_texts[row - 1]
+            desc_str = desc_texts[row - 1]
+
+            # نتأكد أن السطر فيه Part أو Description
+            if not (part_str or desc_str):
                 continue
 
-            no_int = to_int_or_none(no_val)
+            no_int = to_int(no_val)
             if no_int is None:
                 continue
 
-            qty_int = to_int_or_none(qty_val)
-
-            part_str = str(part_val).strip() if part_val is not None else ""
-            desc_str = str(desc_val).strip() if desc_val is not None else ""
+            qty_int = to_int(qty_val)
 
-            rows_for_excel.append(
+            append_row(
                 (
                     uid,            # PackageId
                     title_trim,     # Title - TRIM
@@ -511,95 +610,133 @@ def process_workbook(path: str) -> List[tuple]:
     return rows_for_excel
 
 
-# ==========================
-# الدالة الرئيسية
-# ==========================
+def process_file(full_path: str) -> List[tuple]:
+    """
+    تُنفَّذ داخل process منفصل: تطبع عنوان الملف ثم تعالجه.
+    """
+    print()
+    rel = os.path.relpath(full_path, ROOT_DIR)
+    print(f"{MAGENTA}========== Processing file: {rel} =========={RESET}")
+    # أي خطأ غير متوقع في ملف واحد لا يجب أن يوقف باقي الملفات (ولا يترك ملف إخراج ناقصاً)
+    try:
+        return process_workbook(full_path)
+    except Exception as e:
+        log_error(f"Failed to process '{rel}': {e}. Skipping.")
+        return []
 
-def main():
+
+def result_cache_key(path: str) -> Optional[str]:
     """
-    - يعالج كل ملف .xlsx في ROOT_DIR وفي المجلدات الفرعية داخله.
-    - يبني ملف إكسل جديد packages_data.xlsx
-      يحتوي أسطر القطع مع تكرار بيانات الباكج لكل سطر.
-    - يترك أعمدة الصورة واسم الصورة فارغين دائماً.
+    مفتاح الملف في الكاش: نسخة الكاش + المسار + وقت التعديل (ns) + الحجم.
+    ترجع None لو تعذّر stat (الملف لا يُخزّن ولا يُقرأ من الكاش).
     """
-    xlsx_files: List[str] = []
-    for dirpath, _, filenames in os.walk(ROOT_DIR):
-        for name in filenames:
-            lower = name.lower()
-            if not lower.endswith(".xlsx"):
-                continue
-            if name.startswith("~$"):
-                continue
-            xlsx_files.append(os.path.join(dirpath, name))
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return f"{RESULT_CACHE_VERSION}|{os.path.abspath(path)}|{st.st_mtime_ns}|{st.st_size}"
 
-    if not xlsx_files:
-        log_error(f"No .xlsx files found under ROOT_DIR: {ROOT_DIR}")
+
+def iter_file_results(executor, xlsx_files: List[str], cache) -> Iterator[List[tuple]]:
+    """
+    ترجع أسطر كل ملف بنفس ترتيب xlsx_files.
+    مع الكاش: الملفات المحفوظة نتائجها تُقرأ منه، والباقي فقط يُرسل للـ processes،
+    ونتيجته تُحفظ في الكاش (إن لم تكن فارغة: الفشل قد يكون مؤقتاً مثل ملف مفتوح).
+    """
+    if cache is None:
+        yield from executor.map(process_file, xlsx_files)
         return
 
-    log_info(f"Found {len(xlsx_files)} .xlsx file(s) under ROOT_DIR: {ROOT_DIR}")
-    for path in xlsx_files:
-        rel = os.path.relpath(path, ROOT_DIR)
-        log_debug(f"- {rel}")
+    keys = [result_cache_key(path) for path in xlsx_files]
+    pending = [path for path, key in zip(xlsx_files, keys) if key is None or key not in cache]
+    if len(pending) < len(xlsx_files):
+        log_info(f"{len(xlsx_files) - len(pending)} file(s) loaded from result cache.")
 
-    all_rows: List[tuple] = []
+    results = executor.map(process_file, pending)
+    for key in keys:
+        rows = cache.get(key) if key is not None else None
+        if rows is None:
+            rows = next(results)
+            if rows and key is not None:
+                cache[key] = rows
+        yield rows
 
-    for full_path in xlsx_files:
-        print()
-        rel = os.path.relpath(full_path, ROOT_DIR)
-        print(f"{MAGENTA}========== Processing file: {rel} =========={RESET}")
-        rows = process_workbook(full_path)
-        all_rows.extend(rows)
 
-    if not all_rows:
-        log_warn("No rows were collected. Excel data file will not be created.")
-        return
+# ==========================
+# الدالة الرئيسية
+# ==========================
+
+def find_xlsx_files(root_dir: str) -> List[str]:
+    """
+    تجمع مسارات ملفات .xlsx في root_dir وفي كل المجلدات الفرعية بنفس ترتيب os.walk
+    (ملفات المجلد أولاً ثم المجلدات الفرعية)، مع تجاهل ملفات إكسل المؤقتة (~$).
+    os.scandir يرجّع نوع كل entry من قراءة المجلد نفسها بدون stat إضافي.
+    """
+    xlsx_files: List[str] = []
+    subdirs: List[str] = []
+    try:
+        with os.scandir(root_dir) as entries:
+            for entry in entries:
+                if entry.is_dir(follow_symlinks=False):
+                    subdirs.append(entry.path)
+                    continue
+                name = entry.name
+                if name.lower().endswith(".xlsx") and not name.startswith("~$"):
+                    xlsx_files.append(entry.path)
+    except OSError:
+        return xlsx_files
+
+    for subdir in subdirs:
+        xlsx_files.extend(find_xlsx_files(subdir))
+    return xlsx_files
+
+
+# عرض الأعمدة (مع أعمدة الصورة لكن تبقى فارغة)
+OUTPUT_COLUMN_WIDTHS = {
+    "A": 40,  # PackageId
+    "B": 9,   # Image
+    "C": 10,  # ImagePath
+    "D": 30,  # Title - TRIM
+    "E": 30,  # PackageName
+    "F": 5,   # No
+    "G": 18,  # PartNo
+    "H": 20,  # Part Name And Standard
+    "I": 4,   # QTY
+}
 
-    wb_out = Workbook()
-    ws_out = wb_out.active
-    ws_out.title = "packages"
-
-    # عرض الأعمدة (مع أعمدة الصورة لكن تبقى فارغة)
-    ws_out.column_dimensions["A"].width = 40  # PackageId
-    ws_out.column_dimensions["B"].width = 9   # Image
-    ws_out.column_dimensions["C"].width = 10  # ImagePath
-    ws_out.column_dimensions["D"].width = 30  # Title - TRIM
-    ws_out.column_dimensions["E"].width = 30  # PackageName
-    ws_out.column_dimensions["F"].width = 5   # No
-    ws_out.column_dimensions["G"].width = 18  # PartNo
-    ws_out.column_dimensions["H"].width = 20  # Part Name And Standard
-    ws_out.column_dimensions["I"].width = 4   # QTY
-
-    header = [
-        "PackageId",
-        "Image",       # عمود معاينة الصورة (يبقى فارغ دائماً)
-        "ImagePath",   # اسم ملف الصورة (يبقى فارغ دائماً)
-        "Title - TRIM",
-        "PackageName",
-        "No",
-        "PartNo",
-        "Part Name And Standard",
-        "QTY",
-        "Category",
-        "delete",
-        "price",
-        "Description",
-        "Old Part No.",
-        "Names and specifications of old parts",
-        "note",
-        "is_red",
-        "is_line",
-        "is_deleted",
-        "is_orange",
-        "is_pink",
-        "is_yellow",
-        "internal_notes",
-    ]
-    ws_out.append(header)
-
-    num_cols = len(header)
-
-    row_idx = 1
-    last_pkg_key = None
+OUTPUT_HEADER = [
+    "PackageId",
+    "Image",       # عمود معاينة الصورة (يبقى فارغ دائماً)
+    "ImagePath",   # اسم ملف الصورة (يبقى فارغ دائماً)
+    "Title - TRIM",
+    "PackageName",
+    "No",
+    "PartNo",
+    "Part Name And Standard",
+    "QTY",
+    "Category",
+    "delete",
+    "price",
+    "Description",
+    "Old Part No.",
+    "Names and specifications of old parts",
+    "note",
+    "is_red",
+    "is_line",
+    "is_deleted",
+    "is_orange",
+    "is_pink",
+    "is_yellow",
+    "internal_notes",
+]
+
+
+def iter_output_rows(all_rows: Iterable[tuple]):
+    """
+    ترجع قيم أسطر ملف الإخراج بالترتيب (بعد الهيدر)،
+    مع None للسطر الفارغ الذي يفصل بين كل باكج والتي تليها.
+    """
+    last_uid = None
 
     for row_data in all_rows:
         (
@@ -613,14 +750,11 @@ def main():
             category,
         ) = row_data
 
-        pkg_key = (uid, title_trim, pkg_name)
-
-        if last_pkg_key is not None and pkg_key != last_pkg_key:
-            row_idx += 1
-            ws_out.append([""] * num_cols)
+        # uid وحده يعرّف الباكج (uuid4 جديد لكل باكج)، فلا حاجة لـ tuple مع العنوان والاسم
+        if last_uid is not None and uid != last_uid:
+            yield None
 
-        row_idx += 1
-        ws_out.append([
+        yield [
             "",           # PackageId
             "",            # Image (فارغ)
             "",            # ImagePath (فارغ)
@@ -644,12 +778,144 @@ def main():
             "",            # is_pink
             "",            # is_yellow
             "",            # internal_notes
-        ])
+        ]
 
-        last_pkg_key = pkg_key
+        last_uid = uid
 
-    wb_out.save(OUTPUT_EXCEL)
-    log_success(f"Data Excel file created: '{OUTPUT_EXCEL}'")
+
+def write_output_openpyxl(all_rows: Iterable[tuple], path: str) -> None:
+    """
+    تكتب ملف الإخراج packages_data.xlsx بـ openpyxl من أسطر القطع بالترتيب،
+    مع سطر فارغ بين كل باكج والتي تليها.
+    """
+    # وضع write_only: الأسطر تُكتب مباشرة للملف بدل الاحتفاظ بكل الخلايا في الذاكرة حتى save()
+    # (عرض الأعمدة يجب أن يُضبط قبل أول append)
+    wb_out = Workbook(write_only=True)
+    ws_out = wb_out.create_sheet("packages")
+
+    for letter, width in OUTPUT_COLUMN_WIDTHS.items():
+        ws_out.column_dimensions[letter].width = width
+
+    ws_out.append(OUTPUT_HEADER)
+
+    for values in iter_output_rows(all_rows):
+        # None → سطر فارغ تماماً (بدون إنشاء خلايا)
+        ws_out.append(values if values is not None else [])
+
+    wb_out.save(path)
+
+
+def write_output_xlsxwriter(all_rows: Iterable[tuple], path: str) -> None:
+    """
+    تكتب ملف الإخراج بـ xlsxwriter في وضع constant_memory (كل سطر يُكتب للديسك مباشرة)،
+    بدون كائنات خلايا لكل قيمة كما في openpyxl.
+    """
+    import xlsxwriter
+
+    wb_out = xlsxwriter.Workbook(path, {"constant_memory": True})
+    try:
+        ws_out = wb_out.add_worksheet("packages")
+
+        for letter, width in OUTPUT_COLUMN_WIDTHS.items():
+            ws_out.set_column(f"{letter}:{letter}", width)
+
+        ws_out.write_row(0, 0, OUTPUT_HEADER)
+
+        row = 0
+        for values in iter_output_rows(all_rows):
+            row += 1
+            # السطر الفارغ لا يحتاج كتابة، يكفي أن يتقدم رقم السطر
+            if values is not None:
+                ws_out.write_row(row, 0, values)
+    finally:
+        wb_out.close()
+
+
+def write_output_csv(all_rows: Iterable[tuple], path: str) -> None:
+    """
+    تكتب نفس أسطر ملف الإخراج (مع الأسطر الفارغة بين الباكجات) في ملف CSV.
+    utf-8-sig حتى يتعرف إكسل على الترميز عند فتح الملف مباشرة.
+    """
+    with open(path, "w", newline="", encoding="utf-8-sig") as f:
+        writer = csv.writer(f)
+        writer.writerow(OUTPUT_HEADER)
+        for values in iter_output_rows(all_rows):
+            writer.writerow(values if values is not None else ())
+
+
+def write_output(all_rows: Iterable[tuple]) -> None:
+    """
+    تكتب ملف الإخراج (OUTPUT_EXCEL أو OUTPUT_CSV حسب OUTPUT_FORMAT) في ملف مؤقت بجانبه،
+    ثم تنقله مكان الملف النهائي بـ os.replace فقط بعد انتهاء كل الأسطر.
+    الأسطر تصل تدريجياً من الـ processes، فلو توقف التشغيل في المنتصف
+    لا يبقى ملف إخراج صالح الشكل لكن ناقص؛ الملف المؤقت يُحذف.
+    """
+    output_path = OUTPUT_CSV if OUTPUT_FORMAT == "csv" else OUTPUT_EXCEL
+    root, ext = os.path.splitext(output_path)
+    tmp_path = f"{root}.tmp{ext}"
+
+    try:
+        if OUTPUT_FORMAT == "csv":
+            write_output_csv(all_rows, tmp_path)
+        elif OUTPUT_ENGINE == "xlsxwriter":
+            write_output_xlsxwriter(all_rows, tmp_path)
+        else:
+            write_output_openpyxl(all_rows, tmp_path)
+    except BaseException:
+        # حتى مع Ctrl+C: لا نترك الملف المؤقت
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+    os.replace(tmp_path, output_path)
+
+
+def main():
+    """
+    - يعالج كل ملف .xlsx في ROOT_DIR وفي المجلدات الفرعية داخله.
+    - يبني ملف إكسل جديد packages_data.xlsx (أو packages_data.csv حسب OUTPUT_FORMAT)
+      يحتوي أسطر القطع مع تكرار بيانات الباكج لكل سطر.
+    - يترك أعمدة الصورة واسم الصورة فارغين دائماً.
+    """
+    # نجمع كل ملفات .xlsx في ROOT_DIR وفي كل المجلدات الفرعية
+    xlsx_files = find_xlsx_files(ROOT_DIR)
+
+    if not xlsx_files:
+        log_error(f"No .xlsx files found under ROOT_DIR: {ROOT_DIR}")
+        return
+
+    log_info(f"Found {len(xlsx_files)} .xlsx file(s) under ROOT_DIR: {ROOT_DIR}")
+    if DEBUG_ENABLED:
+        for path in xlsx_files:
+            rel = os.path.relpath(path, ROOT_DIR)
+            log_debug(f"- {rel}")
+
+    # الملفات مستقلة عن بعضها فنعالجها بالتوازي على عدة processes؛
+    # executor.map يرجّع النتائج بنفس ترتيب الملفات (اللوغ فقط قد يتداخل)،
+    # والكتابة تبدأ مع نتيجة أول ملف بدل تجميع كل الأسطر في قائمة واحدة أولاً.
+    max_workers = min(len(xlsx_files), os.cpu_count() or 1)
+    cache = shelve.open(RESULT_CACHE_FILE) if USE_RESULT_CACHE else None
+    try:
+        with ProcessPoolExecutor(max_workers=max_workers) as executor:
+            all_rows = chain.from_iterable(iter_file_results(executor, xlsx_files, cache))
+
+            # نتأكد أن هناك سطراً واحداً على الأقل قبل إنشاء ملف الإخراج
+            first_row = next(all_rows, None)
+            if first_row is None:
+                log_warn("No rows were collected. Excel data file will not be created.")
+                return
+
+            all_rows = chain((first_row,), all_rows)
+
+            write_output(all_rows)
+    finally:
+        if cache is not None:
+            cache.close()
+
+    if OUTPUT_FORMAT == "csv":
+        log_success(f"Data CSV file created: '{OUTPUT_CSV}'")
+    else:
+        log_success(f"Data Excel file created: '{OUTPUT_EXCEL}'")
 
 
 if __name__ == "__main__":
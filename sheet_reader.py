@@ -0,0 +1,131 @@
+"""
+قراءة الشيت النشطة (القيم + الدمج + ارتفاعات الصفوف) المشتركة بين extract_images_all.py و packages.py.
+المسار السريع يستخدم API داخلياً في openpyxl، لذلك هو في مكان واحد فقط.
+"""
+from typing import Callable, Dict, List, Tuple
+
+from openpyxl import load_workbook
+from openpyxl.worksheet.cell_range import CellRange
+
+try:
+    # API داخلي في openpyxl للمسار السريع في read_sheet_data (النسخة مثبّتة في requirements.txt)
+    from openpyxl.worksheet._reader import WorkSheetParser
+except ImportError:
+    WorkSheetParser = None
+
+# أقل عرض للـ grid المقروء من الشيت: عمود الفئة (F) ونافذة البحث عن عمود No تصل إليه دائماً
+MIN_GRID_COLS = 6
+
+
+def read_sheet_data(
+    path: str,
+    log_warn: Callable[[str], None] = print,
+) -> Tuple[List[list], List[CellRange], Dict[int, float], float]:
+    """
+    تقرأ الشيت النشطة في الملف وترجع:
+    - grid: قائمة صفوف بنفس العرض (القيم فقط)
+    - merged_ranges: نطاقات الدمج
+    - row_heights: {رقم الصف: الارتفاع بالنقاط} للصفوف ذات الارتفاع المحدد
+    - default_height: ارتفاع الصف الافتراضي بالنقاط
+    بنفس نتيجة التحميل الكامل: خلايا الدمج غير الأولى تصبح None، والأبعاد تشمل نطاقات الدمج.
+
+    المسار السريع (parse_sheet_xml) يعتمد على API داخلي في openpyxl (مثبّت في requirements.txt)؛
+    لو لم يعد متوافقاً مع النسخة المثبتة نرجع للتحميل العادي (read_sheet_data_full)
+    ونكتب تحذيراً عبر log_warn (دالة اللوغ في السكربت المستدعي).
+    """
+    if WorkSheetParser is not None:
+        try:
+            wb = load_workbook(path, read_only=True, data_only=True)
+            try:
+                return parse_sheet_xml(wb, wb.active)
+            finally:
+                wb.close()
+        except (TypeError, AttributeError) as e:
+            log_warn(f"Fast sheet reader not compatible with this openpyxl ({e}); using full load.")
+    return read_sheet_data_full(path)
+
+
+def parse_sheet_xml(wb, ws) -> Tuple[List[list], List[CellRange], Dict[int, float], float]:
+    """
+    الشيت (المفتوح بوضع read_only) في مرور واحد على الـ XML بـ WorkSheetParser الداخلي في openpyxl:
+    لا تُبنى كائنات Cell، والدمج وارتفاعات الصفوف تُقرأ من نفس المرور.
+    """
+    rows: Dict[int, list] = {}
+    max_row = 1
+    max_col = 1
+    with ws._get_source() as src:
+        parser = WorkSheetParser(
+            src,
+            ws._shared_strings,
+            data_only=wb.data_only,
+            epoch=wb.epoch,
+            date_formats=wb._date_formats,
+            timedelta_formats=wb._timedelta_formats,
+        )
+        for row_idx, cells in parser.parse():
+            if not cells:
+                continue
+            rows[row_idx] = cells
+            max_row = max(max_row, row_idx)
+            max_col = max(max_col, cells[-1]["column"])
+
+    merged_ranges: List[CellRange] = []
+    if parser.merged_cells is not None:
+        for merge_cell in parser.merged_cells.mergeCell:
+            merged_range = CellRange(merge_cell.ref)
+            merged_ranges.append(merged_range)
+            max_row = max(max_row, merged_range.max_row)
+            max_col = max(max_col, merged_range.max_col)
+
+    # العرض لا يقل عن MIN_GRID_COLS (العمود F): الفئة ونافذة البحث عن عمود No تصل إليه دائماً
+    # (كانت قراءة هذه الخلايا في الوضع الكامل تنشئها فيزيد max_column، فنحافظ على نفس السلوك).
+    width = max(max_col, MIN_GRID_COLS)
+    grid = [[None] * width for _ in range(max_row)]
+    for row_idx, cells in rows.items():
+        values = grid[row_idx - 1]
+        for cell in cells:
+            values[cell["column"] - 1] = cell["value"]
+
+    # مثل openpyxl: لا يبقى في الدمج إلا قيمة الخلية الأولى (أعلى اليسار)
+    for merged_range in merged_ranges:
+        for r in range(merged_range.min_row, merged_range.max_row + 1):
+            values = grid[r - 1]
+            for c in range(merged_range.min_col, merged_range.max_col + 1):
+                if r != merged_range.min_row or c != merged_range.min_col:
+                    values[c - 1] = None
+
+    row_heights: Dict[int, float] = {}
+    for r, attrs in parser.row_dimensions.items():
+        if "ht" in attrs:
+            row_heights[int(r)] = float(attrs["ht"])
+
+    sheet_format = getattr(parser, "sheet_format", None)
+    default_height = (sheet_format.defaultRowHeight if sheet_format is not None else None) or 15
+
+    return grid, merged_ranges, row_heights, default_height
+
+
+def read_sheet_data_full(path: str) -> Tuple[List[list], List[CellRange], Dict[int, float], float]:
+    """
+    نفس نتيجة parse_sheet_xml لكن بالـ API العام فقط (load_workbook بالوضع الكامل):
+    أبطأ وتستهلك ذاكرة أكثر، وتُستخدم فقط لو المسار السريع غير متوافق مع openpyxl المثبتة.
+    """
+    wb = load_workbook(path, read_only=False, data_only=True)
+    try:
+        ws = wb.active
+        width = max(ws.max_column, MIN_GRID_COLS)
+        grid = [
+            list(values)
+            for values in ws.iter_rows(min_row=1, max_row=ws.max_row, max_col=width, values_only=True)
+        ]
+        merged_ranges: List[CellRange] = [CellRange(m.coord) for m in ws.merged_cells.ranges]
+        row_heights: Dict[int, float] = {
+            r: float(dim.height)
+            for r, dim in ws.row_dimensions.items()
+            if dim.height is not None
+        }
+        default_height = ws.sheet_format.defaultRowHeight or 15
+    finally:
+        wb.close()
+
+    return grid, merged_ranges, row_heights, default_height
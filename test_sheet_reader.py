@@ -0,0 +1,110 @@
+import datetime
+import os
+import random
+import sys
+import tempfile
+import unittest
+
+from openpyxl import Workbook, load_workbook
+from openpyxl.worksheet.cell_range import CellRange
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import sheet_reader  # noqa: E402
+
+# عدد الشيتات العشوائية (seed ثابت لكل شيت حتى تتكرر النتيجة)
+RANDOM_SHEETS = 150
+
+VALUES = [
+    None, "", " ", "x", " Foo ", "#N/A", "#REF!", "No", "Part Number", "QTY",
+    0, 3, -7, 2.5, 3.0, True, False,
+    datetime.datetime(2024, 5, 17, 8, 30), datetime.date(2023, 1, 2),
+]
+
+
+def save_random_sheet(path: str, rnd: random.Random) -> None:
+    """
+    شيت عشوائي: قيم متنوعة، دمج أفقي/عمودي (مع وبدون قيم مخفية تحته)، ارتفاعات صفوف،
+    وأحياناً ارتفاع افتراضي مخصص.
+    """
+    wb = Workbook()
+    ws = wb.active
+    rows, cols = rnd.randint(1, 25), rnd.randint(1, 9)
+    for r in range(1, rows + 1):
+        for c in range(1, cols + 1):
+            if rnd.random() < 0.5:
+                ws.cell(r, c, rnd.choice(VALUES))
+
+    for _ in range(rnd.randint(0, 4)):
+        r, c = rnd.randint(1, rows + 2), rnd.randint(1, cols + 2)
+        merged_range = CellRange(
+            min_row=r,
+            min_col=c,
+            max_row=r + rnd.randint(0, 3),
+            max_col=c + rnd.randint(0, 2),
+        )
+        if any(not merged_range.isdisjoint(other) for other in ws.merged_cells.ranges):
+            continue
+        if rnd.random() < 0.5:
+            ws.merge_cells(merged_range.coord)
+        else:
+            # بدون مسح الخلايا المغطاة: القيم تبقى في الـ XML (كما في ملفات بعض البرامج الأخرى)
+            ws.merged_cells.add(merged_range)
+
+    for r in range(1, rows + 3):
+        if rnd.random() < 0.2:
+            ws.row_dimensions[r].height = rnd.choice([5, 12.75, 20, 40])
+    if rnd.random() < 0.3:
+        ws.sheet_format.defaultRowHeight = rnd.choice([10, 18.5, 24])
+        ws.sheet_format.customHeight = True
+
+    wb.save(path)
+
+
+def read_fast(path: str):
+    wb = load_workbook(path, read_only=True, data_only=True)
+    try:
+        return sheet_reader.parse_sheet_xml(wb, wb.active)
+    finally:
+        wb.close()
+
+
+def normalize(result):
+    grid, merged_ranges, row_heights, default_height = result
+    return grid, sorted(m.coord for m in merged_ranges), row_heights, default_height
+
+
+class ReadSheetDataTest(unittest.TestCase):
+    """المسار السريع (WorkSheetParser الداخلي) يجب أن يرجع نفس نتيجة التحميل الكامل بالـ API العام."""
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_fast_matches_full(self):
+        self.assertIsNotNone(sheet_reader.WorkSheetParser, "openpyxl private sheet parser not available")
+        for seed in range(RANDOM_SHEETS):
+            path = os.path.join(self.tmp.name, f"sheet_{seed}.xlsx")
+            save_random_sheet(path, random.Random(seed))
+            with self.subTest(seed=seed):
+                self.assertEqual(
+                    normalize(read_fast(path)),
+                    normalize(sheet_reader.read_sheet_data_full(path)),
+                )
+
+    def test_read_sheet_data_falls_back_to_full_load(self):
+        path = os.path.join(self.tmp.name, "fallback.xlsx")
+        save_random_sheet(path, random.Random(0))
+        saved = sheet_reader.WorkSheetParser
+        sheet_reader.WorkSheetParser = None
+        try:
+            result = sheet_reader.read_sheet_data(path)
+        finally:
+            sheet_reader.WorkSheetParser = saved
+        self.assertEqual(normalize(result), normalize(read_fast(path)))
+
+
+if __name__ == "__main__":
+    unittest.main()